@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import numpy as np
+from main import FlightSchedule, Graph, HashTable, HeapSort, RouteRanking, ROUTE_DTYPE, MINUTES_PER_DAY, format_time
+
+CODE_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789abcdefghijklmnopqrstuvwxyz'
+
+def airport_codes(num_airports):
+    base = len(CODE_ALPHABET)
+    return [CODE_ALPHABET[i // (base * base) % base] + CODE_ALPHABET[i // base % base] + CODE_ALPHABET[i % base]
+            for i in range(num_airports)]
+
+def hub_and_spoke_routes(num_airports, routes_per_airport=4, seed=0):
+    # Preferential attachment: each new airport links to existing ones in proportion to
+    # their degree, which yields a scale-free network dominated by a few hubs.
+    rnd = random.Random(seed)
+    targets = [0]
+    routes = []
+    for airport in range(1, num_airports):
+        for hub in {rnd.choice(targets) for _ in range(min(routes_per_airport, airport))}:
+            distance = rnd.randint(200, 12000)
+            routes.append((airport, hub, distance))
+            routes.append((hub, airport, distance))
+            targets.extend((airport, hub))
+    return routes
+
+def regional_routes(num_airports, num_regions=20, routes_per_airport=4, long_haul_share=0.05, seed=0):
+    # Dense short-haul links inside each region and a few long-haul links between regional hubs.
+    rnd = random.Random(seed)
+    regions = [list(range(region, num_airports, num_regions)) for region in range(num_regions)]
+    routes = []
+    for members in regions:
+        for airport in members:
+            for _ in range(routes_per_airport):
+                other = rnd.choice(members)
+                if other != airport:
+                    routes.append((airport, other, rnd.randint(100, 1500)))
+    hubs = [members[0] for members in regions if members]
+    for _ in range(max(1, int(long_haul_share * len(routes)))):
+        start, end = rnd.sample(hubs, 2) if len(hubs) > 1 else (hubs[0], hubs[0])
+        routes.append((start, end, rnd.randint(3000, 15000)))
+    return routes
+
+NETWORKS = {'hub': hub_and_spoke_routes, 'regional': regional_routes}
+
+def build_graph(codes, routes):
+    graph = Graph(len(codes))
+    for code in codes:
+        graph.add_vertex(code)
+    for start, end, distance in routes:
+        graph.add_edge(codes[start], codes[end], distance)
+    graph.merge_pending()
+    return graph
+
+def measure(function, repeat, warmup):
+    for _ in range(warmup):
+        function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    timings = np.array(timings)
+    return {'repeat': repeat, 'min': float(timings.min()), 'mean': float(timings.mean()),
+            'median': float(np.median(timings)), 'p90': float(np.percentile(timings, 90)),
+            'p99': float(np.percentile(timings, 99))}
+
+def workloads(network, size, args):
+    rnd = random.Random(args.seed)
+    codes = airport_codes(size)
+    routes = NETWORKS[network](size, seed=args.seed)
+    graph = build_graph(codes, routes)
+    queries = [(rnd.choice(codes), rnd.choice(codes)) for _ in range(args.queries)]
+
+    csv_file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+    with csv_file:
+        for start, end, distance in routes:
+            csv_file.write(f"{codes[start]},{codes[end]},{distance}\n")
+
+    def load_csv():
+        fresh = Graph(size)
+        for code in codes:
+            fresh.add_vertex(code)
+        fresh.load_csv(csv_file.name)
+
+    # A day's timetable: flights_per_route departures on every route, flown at about 800 km/h.
+    schedule_rnd = random.Random(args.seed)
+    schedule_file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+    with schedule_file:
+        for start, end, distance in routes:
+            for _ in range(args.flights_per_route):
+                departure = schedule_rnd.randrange(MINUTES_PER_DAY)
+                arrival = (departure + 30 + distance * 60 // 800) % MINUTES_PER_DAY
+                schedule_file.write(f"{codes[start]},{codes[end]},{format_time(departure)},{format_time(arrival)}\n")
+
+    def load_schedule():
+        schedule = FlightSchedule(graph)
+        schedule.load_csv(schedule_file.name)
+        return schedule
+
+    yield 'load_csv', load_csv
+    yield 'add_edge', lambda: build_graph(codes, routes)
+    for layovers in args.layovers:
+        yield f'bfs_{layovers}', lambda layovers=layovers: [graph.bfs(start, end, layovers) for start, end in queries]
+        yield f'bfs_bidirectional_{layovers}', lambda layovers=layovers: [graph.bfs(start, end, layovers, bidirectional=True) for start, end in queries]
+        yield f'shortest_path_{layovers}', lambda layovers=layovers: [graph.shortest_path(start, end, layovers) for start, end in queries]
+
+    schedule = load_schedule()
+    yield 'schedule_load', load_schedule
+    for layovers in args.layovers:
+        yield f'earliest_arrival_{layovers}', lambda layovers=layovers: [schedule.earliest_arrival(start, end, '09:00', layovers) for start, end in queries]
+
+    def hash_insert():
+        table = HashTable(8)
+        for code in codes:
+            table.insert(code, code)
+        return table
+
+    table = hash_insert()
+    yield 'hashtable_insert', hash_insert
+    yield 'hashtable_search', lambda: [table.search(code) for code in codes]
+
+    def hash_delete():
+        filled = hash_insert()
+        for code in codes:
+            filled.delete(code)
+
+    yield 'hashtable_insert_delete', hash_delete
+
+    candidates = np.empty((size * 10,), dtype=ROUTE_DTYPE)
+    candidates['layovers'] = np.array([rnd.randint(0, 4) for _ in range(candidates.size)])
+    candidates['distance'] = np.array([rnd.randint(100, 40000) for _ in range(candidates.size)])
+    yield 'sort_ranking', lambda: RouteRanking.sort(candidates, ('distance', 'layovers'))
+    yield 'sort_top10', lambda: RouteRanking.top_k(candidates, 10, ('distance', 'layovers'))
+    if candidates.size <= args.heapsort_limit:
+        yield 'sort_heapsort', lambda: HeapSort.sort(candidates.copy(), 2)
+    os.unlink(csv_file.name)
+    os.unlink(schedule_file.name)
+
+def run(args):
+    results = {}
+    for network in args.networks:
+        for size in args.sizes:
+            for name, function in workloads(network, size, args):
+                if args.workloads and not any(name.startswith(prefix) for prefix in args.workloads):
+                    continue
+                key = f"{network}/{size}/{name}"
+                results[key] = measure(function, args.repeat, args.warmup)
+                print(f"{key:<45} median {results[key]['median']:.6f}s  p90 {results[key]['p90']:.6f}s", file=sys.stderr)
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                     'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'seed': args.seed, 'queries': args.queries},
+            'results': results}
+
+def compare(report, baseline, threshold):
+    # A workload regresses when its median is more than threshold slower than the baseline median.
+    regressions = []
+    for key, stats in report['results'].items():
+        before = baseline['results'].get(key)
+        if before is None:
+            continue
+        change = stats['median'] / before['median'] - 1 if before['median'] > 0 else 0.0
+        status = 'REGRESSION' if change > threshold else 'ok'
+        print(f"{key:<45} {before['median']:.6f}s -> {stats['median']:.6f}s ({change:+.1%}) {status}")
+        if change > threshold:
+            regressions.append(key)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Airline Management System benchmarks")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument("--networks", nargs='+', choices=sorted(NETWORKS), default=sorted(NETWORKS))
+    parser.add_argument("--layovers", type=int, nargs='+', default=[1, 2])
+    parser.add_argument("--workloads", nargs='*', help="only run workloads whose name starts with one of these")
+    parser.add_argument("--queries", type=int, default=20, help="route queries per bfs/shortest_path timing")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flights-per-route", type=int, default=2, help="daily departures per route in the timetable workloads")
+    parser.add_argument("--heapsort-limit", type=int, default=10000, help="largest input timed with HeapSort")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed median slowdown before flagging")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
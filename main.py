@@ -1,127 +1,1773 @@
+import argparse
+import asyncio
+import bisect
+import cProfile
+import hashlib
+import heapq
+import io
+import itertools
+import json
+import os
+import pstats
+import struct
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+from collections import OrderedDict, deque
 import numpy as np
 
+ROUTE_DTYPE = np.dtype([('path', 'O'), ('layovers', int), ('distance', int)])
+# Airports are int32 ids into Graph.vertices; code columns take the width of the longest code.
+INDEX_DTYPE = np.int32
+WEIGHT_DTYPE = np.int32
+# Weights are non-negative: Dijkstra, A* and Yen's algorithm all rely on it.
+WEIGHT_MAX = int(np.iinfo(WEIGHT_DTYPE).max)
+
+def batch_route_dtype(code_dtype='U3'):
+    return np.dtype([('query', int), ('origin', code_dtype), ('destination', code_dtype), ('path', 'O'), ('layovers', int), ('distance', int)])
+
+def leg_dtype(code_dtype='U3'):
+    return np.dtype([('flight', 'U8'), ('origin', code_dtype), ('destination', code_dtype), ('departure', int), ('arrival', int)])
+
+BATCH_ROUTE_DTYPE = batch_route_dtype()
+LEG_DTYPE = leg_dtype()
+EARTH_RADIUS_KM = 6371.0
+MINUTES_PER_DAY = 24 * 60
+MAX_LINE_BYTES = 16 * 1024 * 1024
+
+def great_circle_distance(latitude1, longitude1, latitude2, longitude2):
+    latitude1, longitude1, latitude2, longitude2 = map(np.radians, (latitude1, longitude1, latitude2, longitude2))
+    a = np.sin((latitude2 - latitude1) / 2) ** 2 + np.cos(latitude1) * np.cos(latitude2) * np.sin((longitude2 - longitude1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+class Metrics:
+    # Opt-in counters, gauges and summaries. Hot paths check `enabled` once per call,
+    # so nothing is recorded or timed while it is False.
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+
+    def increment(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        self.gauges[name] = value
+
+    def max_gauge(self, name, value):
+        self.gauges[name] = max(self.gauges.get(name, value), value)
+
+    def observe(self, name, value):
+        total, count, peak = self.summaries.get(name, (0.0, 0, value))
+        self.summaries[name] = (total + value, count + 1, max(peak, value))
+
+    def prometheus_text(self, prefix='airline_'):
+        lines = []
+        for name, value in sorted(self.counters.items()):
+            lines += [f"# TYPE {prefix}{name} counter", f"{prefix}{name} {value}"]
+        for name, value in sorted(self.gauges.items()):
+            lines += [f"# TYPE {prefix}{name} gauge", f"{prefix}{name} {value}"]
+        for name, (total, count, peak) in sorted(self.summaries.items()):
+            lines += [f"# TYPE {prefix}{name} summary", f"{prefix}{name}_sum {total}", f"{prefix}{name}_count {count}",
+                      f"# TYPE {prefix}{name}_max gauge", f"{prefix}{name}_max {peak}"]
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename, prefix='airline_'):
+        with open(filename, 'w') as file:
+            file.write(self.prometheus_text(prefix))
+
+METRICS = Metrics()
+
+@contextmanager
+def profile_query(filename=None, memory=True, limit=25):
+    # Profiles the enclosed block with cProfile (and tracemalloc when memory is True),
+    # then writes the report to filename or prints it.
+    profiler = cProfile.Profile()
+    if memory:
+        tracemalloc.start()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(limit)
+        if memory:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            report.write(f"Memory: current {current} bytes, peak {peak} bytes\n")
+            for stat in snapshot.statistics('lineno')[:limit]:
+                report.write(f"{stat}\n")
+        if filename:
+            with open(filename, 'w') as file:
+                file.write(report.getvalue())
+        else:
+            print(report.getvalue())
+
+SNAPSHOT_MAGIC = b'AMSSNAP\x00'
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_ALIGNMENT = 64
+
+def write_snapshot(filename, kind, meta, arrays):
+    # Layout: magic, header length, JSON header, then each array's raw bytes at an aligned offset.
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+        layout[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += array.nbytes
+    header = json.dumps({'format': SNAPSHOT_FORMAT, 'kind': kind, 'meta': meta, 'arrays': layout}).encode()
+    data_start = -(-(len(SNAPSHOT_MAGIC) + 4 + len(header)) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+    # The arrays may be memmaps of filename itself, so the snapshot goes to a temporary file
+    # that replaces filename only once it is complete.
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(SNAPSHOT_MAGIC + struct.pack('<I', len(header)) + header)
+            for name, array in arrays.items():
+                file.seek(data_start + layout[name]['offset'])
+                file.write(np.ascontiguousarray(array).tobytes())
+            file.truncate(data_start + offset)
+        os.replace(temporary, filename)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+def read_snapshot(filename, kind, mmap=True):
+    with open(filename, 'rb') as file:
+        if file.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(f"{filename} is not a snapshot file")
+        header_length, = struct.unpack('<I', file.read(4))
+        header = json.loads(file.read(header_length))
+    if header['format'] != SNAPSHOT_FORMAT or header['kind'] != kind:
+        raise ValueError(f"{filename} holds a {header['kind']} snapshot in format {header['format']}")
+    data_start = -(-(len(SNAPSHOT_MAGIC) + 4 + header_length) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype, shape = np.dtype(spec['dtype']), tuple(spec['shape'])
+        count = int(np.prod(shape))
+        if count == 0:
+            arrays[name] = np.empty(shape, dtype=dtype)
+        elif mmap:
+            # Copy-on-write pages: processes share the page cache and local edits stay private.
+            arrays[name] = np.memmap(filename, dtype=dtype, mode='c', offset=data_start + spec['offset'], shape=shape)
+        else:
+            arrays[name] = np.fromfile(filename, dtype=dtype, count=count, offset=data_start + spec['offset']).reshape(shape)
+    return header['meta'], arrays
+
+class RouteCache:
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.version = None
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _size(self, routes):
+        return routes.nbytes + sum(path.nbytes for path in routes['path'])
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def get(self, key, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.clear()
+            self.version = version
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, version, routes):
+        if version != self.version:
+            return
+        size = self._size(routes)
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[1]
+        self.entries[key] = (routes, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'invalidations': self.invalidations}
+
 class Graph:
+    # Fields of each delta event, in the order a tuple event lists them after its type.
+    DELTA_FIELDS = {
+        'open_airport': ('code',),
+        'close_airport': ('code',),
+        'add_route': ('origin', 'destination', 'distance'),
+        'remove_route': ('origin', 'destination'),
+        'reweight_route': ('origin', 'destination', 'distance'),
+    }
+
     def __init__(self, num_vertices):
         self.num_vertices = num_vertices
         self.vertices = np.full((num_vertices,), fill_value='', dtype='U3')
-        self.adj_list = np.empty((num_vertices,), dtype=object)
-        for i in range(num_vertices):
-            self.adj_list[i] = np.array([], dtype=np.dtype([('dest', 'U3'), ('weight', int)]))
+        self.indptr = np.zeros((num_vertices + 1,), dtype=int)
+        self.indices = np.array([], dtype=INDEX_DTYPE)
+        self.weights = np.array([], dtype=WEIGHT_DTYPE)
+        # Buffered edges by source as [(destination, weight), ...] in insertion order, and
+        # for each destination the sources that have buffered edges into it.
+        self.pending_edges = {}
+        self.pending_sources = {}
+        self.pending_blocks = []
+        self._adjacency = None
+        self._reverse_adjacency = None
+        self.dead_edges = 0
+        self.load_errors = []
+        self.delta_errors = []
+        self.coordinates = np.full((num_vertices, 2), np.nan)
+        self.vertex_index = {}
+        # Later slots holding a code that is already open, and slots of closed airports, by code.
+        self.duplicate_slots = {}
+        self.closed_slots = {}
+        self.removed = set()
         self.vertex_count = 0
+        self.version = 0
+        self.route_cache = RouteCache()
+
+    def _reserve(self, capacity):
+        # Capacity at least doubles, so a stream of new airports costs amortized O(1) each.
+        if capacity <= self.num_vertices:
+            return
+        capacity = max(capacity, 2 * self.num_vertices)
+        extra = capacity - self.num_vertices
+        self.vertices = np.concatenate([self.vertices, np.full((extra,), '', dtype=self.vertices.dtype)])
+        self.coordinates = np.concatenate([self.coordinates, np.full((extra, 2), np.nan)])
+        self.indptr = np.concatenate([self.indptr, np.full((extra,), self.indptr[-1], dtype=self.indptr.dtype)])
+        self.num_vertices = capacity
+        self._adjacency = None
+        self._reverse_adjacency = None
 
     def add_vertex(self, vertex):
-        if self.vertex_count < self.num_vertices:
-            self.vertices[self.vertex_count] = vertex
+        vertex = str(vertex)
+        if len(vertex) > self.vertices.dtype.itemsize // 4:
+            # Codes are never truncated; the column widens to the longest code seen.
+            self.vertices = self.vertices.astype(f'U{len(vertex)}')
+        if self.closed_slots.get(vertex):
+            # A reopened airport takes back its old slot, whose edges are all tombstoned.
+            index = self.closed_slots[vertex].pop()
+            self.removed.discard(index)
+            self.coordinates[index] = np.nan
+        else:
+            if self.vertex_count == self.num_vertices:
+                self._reserve(self.num_vertices + 1)
+            index = self.vertex_count
             self.vertex_count += 1
+        self.vertices[index] = vertex
+        self._index_vertex(vertex, index)
+        self.version += 1
+
+    def _index_vertex(self, vertex, index):
+        if vertex in self.vertex_index:
+            bisect.insort(self.duplicate_slots.setdefault(vertex, []), index)
         else:
-            print("Graph is full.")
+            self.vertex_index[vertex] = index
+
+    def _index_vertices(self):
+        for index, vertex in enumerate(self.vertices[:self.vertex_count].tolist()):
+            if index not in self.removed:
+                self._index_vertex(vertex, index)
+
+    def remove_vertex(self, vertex):
+        index = self.vertex_index.pop(vertex, -1)
+        if index == -1:
+            return False
+        # Outbound edges are the CSR row and inbound ones come from the reverse index,
+        # so only the airport's own edges are touched.
+        self._drop_pending(index)
+        for source in list(self.pending_sources.get(index, ())):
+            self._drop_pending(source, index)
+        rindptr, redges, _ = self._reverse_index()
+        self._tombstone(list(range(self.indptr[index], self.indptr[index + 1])) + redges[rindptr[index]:rindptr[index + 1]])
+        self.vertices[index] = ''
+        self.removed.add(index)
+        self.closed_slots.setdefault(vertex, []).append(index)
+        self.version += 1
+        # The lowest remaining duplicate of the code becomes the one that lookups resolve to.
+        duplicates = self.duplicate_slots.get(vertex)
+        if duplicates:
+            self.vertex_index[vertex] = duplicates.pop(0)
+            if not duplicates:
+                del self.duplicate_slots[vertex]
+        return True
 
     def _get_vertex_index(self, vertex):
-        index = np.where(self.vertices == vertex)[0]
-        if index.size > 0:
-            return int(index[0])
-        return -1
+        return self.vertex_index.get(vertex, -1)
 
-    def load_csv(self, filename):
+    def save(self, filename):
+        self.compact()
+        removed = sorted(self.removed)
+        # Removed slots are blanked, so the code each one held is saved alongside it for reopening.
+        closed = {index: code for code, indices in self.closed_slots.items() for index in indices}
+        write_snapshot(filename, 'graph', {'num_vertices': self.num_vertices, 'vertex_count': self.vertex_count}, {
+            'vertices': self.vertices, 'indptr': self.indptr, 'indices': self.indices, 'weights': self.weights,
+            'coordinates': self.coordinates, 'removed': np.array(removed, dtype=int),
+            'closed_codes': np.array([closed.get(index, '') for index in removed], dtype=self.vertices.dtype)})
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        meta, arrays = read_snapshot(filename, 'graph', mmap)
+        graph = cls(0)
+        graph.num_vertices = meta['num_vertices']
+        graph.vertex_count = meta['vertex_count']
+        for name in ('vertices', 'indptr', 'indices', 'weights', 'coordinates'):
+            setattr(graph, name, arrays[name])
+        graph.removed = set(arrays['removed'].tolist())
+        if 'closed_codes' in arrays:
+            for index, code in zip(arrays['removed'].tolist(), arrays['closed_codes'].tolist()):
+                if code:
+                    graph.closed_slots.setdefault(code, []).append(index)
+        graph._index_vertices()
+        return graph
+
+    def set_coordinates(self, vertex, latitude, longitude):
+        index = self._get_vertex_index(vertex)
+        if index != -1:
+            self.coordinates[index] = (latitude, longitude)
+
+    def load_coordinates(self, filename):
         try:
             with open(filename, 'r') as file:
                 for line in file:
-                    start, end, weight = line.strip().split(',')
-                    self.add_edge(start, end, int(weight))
+                    vertex, latitude, longitude = line.strip().split(',')
+                    self.set_coordinates(vertex, float(latitude), float(longitude))
         except Exception as e:
             print(f"Error reading file {filename}: {e}")
 
+    def _parse_rows(self, lines, first_line):
+        starts, ends, weights, line_numbers = [], [], [], []
+        for line_number, line in enumerate(lines, first_line):
+            fields = line.strip().split(',')
+            if fields == ['']:
+                continue
+            if len(fields) != 3:
+                self.load_errors.append((line_number, f"expected 3 fields, got {len(fields)}"))
+                continue
+            starts.append(fields[0].strip())
+            ends.append(fields[1].strip())
+            weights.append(fields[2].strip())
+            line_numbers.append(line_number)
+        line_numbers = np.array(line_numbers, dtype=int)
+        try:
+            weights = np.array(weights, dtype=str).astype(int)
+            valid = np.ones((line_numbers.size,), dtype=bool)
+        except (ValueError, OverflowError):
+            parsed = np.zeros((line_numbers.size,), dtype=int)
+            valid = np.ones((line_numbers.size,), dtype=bool)
+            for row, weight in enumerate(weights):
+                try:
+                    parsed[row] = int(weight)
+                except (ValueError, OverflowError):
+                    valid[row] = False
+                    self.load_errors.append((int(line_numbers[row]), f"invalid weight {weight!r}"))
+            weights = parsed
+        for row in np.flatnonzero(valid & ((weights < 0) | (weights > WEIGHT_MAX))):
+            valid[row] = False
+            self.load_errors.append((int(line_numbers[row]), f"weight {int(weights[row])} out of range"))
+        return np.array(starts, dtype=str), np.array(ends, dtype=str), weights, line_numbers, valid
+
+    def _map_codes(self, codes):
+        # Each distinct code in the chunk is resolved once, then broadcast back to the rows.
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        lookup = np.array([self._get_vertex_index(str(code)) for code in unique_codes], dtype=int)
+        return lookup[inverse.reshape(-1)] if unique_codes.size > 0 else np.array([], dtype=int)
+
+    def load_csv(self, filename, chunk_size=100000):
+        started = time.perf_counter()
+        self.load_errors = []
+        self._pending_block()
+        loaded = 0
+        first_line = 1
+        try:
+            with open(filename, 'r') as file:
+                while True:
+                    lines = list(itertools.islice(file, chunk_size))
+                    if not lines:
+                        break
+                    starts, ends, weights, line_numbers, valid = self._parse_rows(lines, first_line)
+                    first_line += len(lines)
+                    start_indices = self._map_codes(starts)
+                    end_indices = self._map_codes(ends)
+                    for codes, indices in ((starts, start_indices), (ends, end_indices)):
+                        for row in np.flatnonzero(valid & (indices == -1)):
+                            self.load_errors.append((int(line_numbers[row]), f"unknown airport {str(codes[row])!r}"))
+                    valid &= (start_indices != -1) & (end_indices != -1)
+                    self.pending_blocks.append((start_indices[valid], end_indices[valid], weights[valid]))
+                    loaded += int(valid.sum())
+        except Exception as e:
+            print(f"Error reading file {filename}: {e}")
+        self.merge_pending()
+        self.version += 1
+        if self.load_errors:
+            self.load_errors.sort()
+            print(f"Skipped {len(self.load_errors)} row(s) in {filename}.")
+            for line_number, reason in self.load_errors[:10]:
+                print(f"  line {line_number}: {reason}")
+        if METRICS.enabled:
+            elapsed = time.perf_counter() - started
+            METRICS.increment('csv_rows_loaded_total', loaded)
+            METRICS.increment('csv_rows_rejected_total', len(self.load_errors))
+            METRICS.observe('csv_load_seconds', elapsed)
+            METRICS.set_gauge('csv_rows_per_second', (loaded + len(self.load_errors)) / elapsed if elapsed > 0 else 0.0)
+        return loaded
+
+    def _check_weight(self, weight):
+        if not 0 <= weight <= WEIGHT_MAX:
+            raise ValueError(f"Weight {weight} is not between 0 and {WEIGHT_MAX}")
+
     def add_edge(self, start, end, weight):
+        self._check_weight(weight)
         start_index = self._get_vertex_index(start)
         end_index = self._get_vertex_index(end)
         if start_index != -1 and end_index != -1:
-            self.adj_list[start_index] = np.append(self.adj_list[start_index], np.array([(end, weight)], dtype=np.dtype([('dest', 'U3'), ('weight', int)])))
+            self.pending_edges.setdefault(start_index, []).append((end_index, weight))
+            self.pending_sources.setdefault(end_index, set()).add(start_index)
+            self.version += 1
 
-    def bfs(self, start, destination, max_layovers):
+    def _route_edges(self, start_index, end_index):
+        # Live CSR edges from start_index to end_index; pending edges are not included.
+        row = np.arange(self.indptr[start_index], self.indptr[start_index + 1])
+        return row[self.indices[row] == end_index]
+
+    def remove_edge(self, start, end):
+        start_index = self._get_vertex_index(start)
+        end_index = self._get_vertex_index(end)
+        if start_index == -1 or end_index == -1:
+            return 0
+        removed = self._drop_pending(start_index, end_index)
+        removed += self._tombstone(self._route_edges(start_index, end_index))
+        if removed:
+            self.version += 1
+        return removed
+
+    def reweight_edge(self, start, end, weight):
+        self._check_weight(weight)
+        start_index = self._get_vertex_index(start)
+        end_index = self._get_vertex_index(end)
+        if start_index == -1 or end_index == -1:
+            return 0
+        if self.pending_blocks:
+            self.merge_pending()
+        buffered = self.pending_edges.get(start_index, [])
+        changed = 0
+        for position, (destination, _) in enumerate(buffered):
+            if destination == end_index:
+                buffered[position] = (destination, weight)
+                changed += 1
+        edges = self._route_edges(start_index, end_index)
+        self.weights[edges] = weight
+        if self._adjacency is not None:
+            for edge in edges.tolist():
+                self._adjacency[2][edge] = weight
+        changed += edges.size
+        if changed:
+            self.version += 1
+        return changed
+
+    def _drop_pending(self, source, destination=None):
+        # Drops buffered edges from source to destination (or to anywhere) without merging;
+        # only that source's buffer is touched. Returns how many were dropped.
+        if self.pending_blocks:
+            self.merge_pending()
+        buffered = self.pending_edges.get(source)
+        if not buffered:
+            return 0
+        kept = [edge for edge in buffered if destination is not None and edge[0] != destination]
+        for end in {edge[0] for edge in buffered} - {edge[0] for edge in kept}:
+            self.pending_sources[end].discard(source)
+            if not self.pending_sources[end]:
+                del self.pending_sources[end]
+        if kept:
+            self.pending_edges[source] = kept
+        else:
+            del self.pending_edges[source]
+        return len(buffered) - len(kept)
+
+    def _tombstone(self, edges):
+        # A dead edge keeps its CSR slot with destination -1 until the next compaction,
+        # so edge ids, indptr and the reverse index all stay valid.
+        edges = np.unique(np.asarray(edges, dtype=int))
+        edges = edges[self.indices[edges] >= 0]
+        self.indices[edges] = -1
+        if self._adjacency is not None:
+            for edge in edges.tolist():
+                self._adjacency[1][edge] = -1
+        self.dead_edges += edges.size
+        return int(edges.size)
+
+    def compact(self):
+        # Merges pending edges and drops dead ones, renumbering the remaining edges.
+        self.merge_pending()
+        if self.dead_edges:
+            sources = np.repeat(np.arange(self.num_vertices), np.diff(self.indptr))
+            alive = self.indices >= 0
+            self._build_csr(sources[alive], self.indices[alive], self.weights[alive])
+
+    def apply_deltas(self, events, compact_ratio=0.25):
+        # Events are tuples such as ('add_route', 'MEL', 'JFK', 16700) or dicts with a 'type'
+        # key and the DELTA_FIELDS names. Bad events are recorded in delta_errors and skipped.
+        started = time.perf_counter()
+        self.delta_errors = []
+        applied = 0
+        for position, event in enumerate(events):
+            if isinstance(event, dict):
+                kind = event.get('type')
+                args = [event.get(field) for field in self.DELTA_FIELDS.get(kind, ())]
+            else:
+                kind, args = event[0], list(event[1:])
+            fields = self.DELTA_FIELDS.get(kind)
+            if fields is None:
+                error = f"unknown event {kind!r}"
+            elif len(args) != len(fields) or any(arg is None for arg in args):
+                error = f"{kind} expects {', '.join(fields)}"
+            else:
+                error = self._apply_delta(kind, args)
+            if error:
+                self.delta_errors.append((position, error))
+            else:
+                applied += 1
+        if self.dead_edges > compact_ratio * max(1, self.indices.size):
+            self.compact()
+        if self.delta_errors:
+            print(f"Skipped {len(self.delta_errors)} delta event(s).")
+            for position, reason in self.delta_errors[:10]:
+                print(f"  event {position}: {reason}")
+        if METRICS.enabled:
+            METRICS.increment('graph_delta_events_total', applied)
+            METRICS.increment('graph_delta_events_rejected_total', len(self.delta_errors))
+            METRICS.set_gauge('graph_dead_edges', self.dead_edges)
+            METRICS.observe('graph_delta_seconds', time.perf_counter() - started)
+        return applied
+
+    def _apply_delta(self, kind, args):
+        codes = [str(code) for code in args[:2]]
+        if kind == 'open_airport':
+            if codes[0] in self.vertex_index:
+                return f"airport {codes[0]!r} is already open"
+            self.add_vertex(codes[0])
+            return None
+        for code in codes:
+            if code not in self.vertex_index:
+                return f"unknown airport {code!r}"
+        if kind == 'close_airport':
+            self.remove_vertex(codes[0])
+            return None
+        if kind == 'remove_route':
+            return None if self.remove_edge(*codes) else f"no route {codes[0]}->{codes[1]}"
+        try:
+            # JSON numbers arrive as floats, including Infinity; only whole ones are distances.
+            if isinstance(args[2], float) and not args[2].is_integer():
+                raise ValueError(args[2])
+            distance = int(args[2])
+            self._check_weight(distance)
+        except (TypeError, ValueError, OverflowError):
+            return f"invalid distance {args[2]!r}"
+        if kind == 'add_route':
+            self.add_edge(*codes, distance)
+            return None
+        return None if self.reweight_edge(*codes, distance) else f"no route {codes[0]}->{codes[1]}"
+
+    def _build_csr(self, sources, destinations, weights):
+        order = np.argsort(sources, kind='stable')
+        self.indices = destinations[order].astype(INDEX_DTYPE)
+        self.weights = weights[order].astype(WEIGHT_DTYPE)
+        self.indptr = np.zeros((self.num_vertices + 1,), dtype=int)
+        np.cumsum(np.bincount(sources, minlength=self.num_vertices), out=self.indptr[1:])
+        self._adjacency = None
+        self._reverse_adjacency = None
+        self.dead_edges = 0
+
+    def _pending_block(self):
+        if self.pending_edges:
+            pending = np.array([(source, destination, weight) for source, edges in self.pending_edges.items()
+                                for destination, weight in edges], dtype=int)
+            self.pending_blocks.append((pending[:, 0], pending[:, 1], pending[:, 2]))
+            self.pending_edges = {}
+            self.pending_sources = {}
+
+    def merge_pending(self):
+        self._pending_block()
+        if not self.pending_blocks:
+            return
+        sources = np.repeat(np.arange(self.num_vertices), np.diff(self.indptr))
+        alive = self.indices >= 0
+        blocks = [(sources[alive], self.indices[alive], self.weights[alive])] + self.pending_blocks
+        self.pending_blocks = []
+        self._build_csr(*(np.concatenate([block[field] for block in blocks]) for field in range(3)))
+
+    def _csr(self):
+        # Python lists of the CSR arrays for the pure-Python traversal loops.
+        self.merge_pending()
+        if self._adjacency is None:
+            self._adjacency = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist())
+        return self._adjacency
+
+    def _reverse_csr(self):
+        self.merge_pending()
+        return self._reverse_index()
+
+    def _reverse_index(self):
+        # Inbound edges grouped by destination, stored as ids into indices/weights.
+        # Built over the merged edges only; dead edges are left out.
+        if self._reverse_adjacency is None:
+            alive = self.indices >= 0
+            self.rindptr = np.zeros((self.num_vertices + 1,), dtype=int)
+            np.cumsum(np.bincount(self.indices[alive], minlength=self.num_vertices), out=self.rindptr[1:])
+            self.redges = np.argsort(self.indices, kind='stable')[alive.size - int(alive.sum()):]
+            sources = np.repeat(np.arange(self.num_vertices), np.diff(self.indptr))
+            self._reverse_adjacency = (self.rindptr.tolist(), self.redges.tolist(), sources.tolist())
+        return self._reverse_adjacency
+
+    def neighbors(self, index):
+        self.merge_pending()
+        begin, end = self.indptr[index], self.indptr[index + 1]
+        alive = self.indices[begin:end] >= 0
+        return zip(self.vertices[self.indices[begin:end][alive]], self.weights[begin:end][alive])
+
+    def _iter_paths(self, start_index, destination_index, max_legs, initial=None, stats=None):
+        # Frontier entries share their prefixes as (airport, parent) linked nodes,
+        # so extending a path never copies it. initial seeds the search with a partial path;
+        # stats, when given, collects [nodes expanded, peak frontier size].
+        indptr, indices, weights = self._csr()
+        can_reach = self._reach_lists(destination_index, max_legs)
+        frontier = deque([initial or ((start_index, None), 0, 0)])
+        while frontier:
+            if stats is not None:
+                stats[0] += 1
+                stats[1] = max(stats[1], len(frontier))
+            node, legs, distance = frontier.popleft()
+            current = node[0]
+            if current == destination_index:
+                yield node, legs, distance
+                continue
+            if legs >= max_legs:
+                continue
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor_index = indices[edge]
+                if neighbor_index < 0:
+                    continue
+                if can_reach is not None and not can_reach[max_legs - legs - 1][neighbor_index]:
+                    continue
+                visited = node
+                while visited is not None and visited[0] != neighbor_index:
+                    visited = visited[1]
+                if visited is None:
+                    frontier.append(((neighbor_index, node), legs + 1, distance + weights[edge]))
+
+    def _node_path(self, node):
+        path = []
+        while node is not None:
+            path.append(node[0])
+            node = node[1]
+        path.reverse()
+        return path
+
+    def iter_routes(self, start, destination, max_layovers, stats=None):
         start_index = self._get_vertex_index(start)
         destination_index = self._get_vertex_index(destination)
         if start_index == -1 or destination_index == -1:
-            return np.array([], dtype=np.dtype([('path', 'O'), ('layovers', int), ('distance', int)]))
-        
-        queue = np.array([(start_index, np.array([start_index], dtype=int), 0)], dtype=np.dtype([('airport', int), ('path', 'O'), ('distance', int)]))
-        routes = np.array([], dtype=np.dtype([('path', 'O'), ('layovers', int), ('distance', int)]))
-
-        while queue.size > 0:
-            current_airport, path, distance = queue[0]
-            queue = np.delete(queue, 0)
-
-            if current_airport == destination_index:
-                route_path = self.vertices[path]
-                routes = np.append(routes, np.array([(route_path, path.size - 1, distance)], dtype=np.dtype([('path', 'O'), ('layovers', int), ('distance', int)])))
-
-            if path.size <= max_layovers + 1:
-                for neighbor in self.adj_list[current_airport]:
-                    neighbor_index = self._get_vertex_index(neighbor['dest'])
-                    if neighbor_index != -1 and neighbor_index not in path:
-                        new_path = np.append(path, neighbor_index)
-                        new_distance = distance + neighbor['weight']
-                        queue = np.append(queue, np.array([(neighbor_index, new_path, new_distance)], dtype=np.dtype([('airport', int), ('path', 'O'), ('distance', int)])))
+            return
+        for node, legs, distance in self._iter_paths(start_index, destination_index, max_layovers + 1, stats=stats):
+            yield self.vertices[self._node_path(node)], legs, distance
+
+    def _half_paths(self, origin_index, stop_index, max_legs, reverse=False, stats=None):
+        # Every simple path of up to max_legs legs leaving (or, reversed, entering)
+        # origin_index, grouped by (legs, far airport). Paths do not continue past stop_index.
+        indptr, indices, weights = self._csr()
+        if reverse:
+            indptr, edge_ids, sources = self._reverse_csr()
+        layers = {}
+        frontier = deque([((origin_index, None), 0, 0)])
+        while frontier:
+            if stats is not None:
+                stats[0] += 1
+                stats[1] = max(stats[1], len(frontier))
+            node, legs, distance = frontier.popleft()
+            current = node[0]
+            layers.setdefault((legs, current), []).append((node, distance))
+            if legs >= max_legs or (current == stop_index and legs > 0):
+                continue
+            for position in range(indptr[current], indptr[current + 1]):
+                edge = edge_ids[position] if reverse else position
+                if indices[edge] < 0:
+                    continue
+                neighbor_index = sources[edge] if reverse else indices[edge]
+                visited = node
+                while visited is not None and visited[0] != neighbor_index:
+                    visited = visited[1]
+                if visited is None:
+                    frontier.append(((neighbor_index, node), legs + 1, distance + weights[edge]))
+        return layers
+
+    def _bidirectional_routes(self, start_index, destination_index, max_legs, stats=None):
+        # A route of m legs splits uniquely at its hub after ceil(m / 2) legs.
+        forward = self._half_paths(start_index, destination_index, (max_legs + 1) // 2, stats=stats)
+        backward = self._half_paths(destination_index, start_index, max_legs // 2, reverse=True, stats=stats)
+        for legs in range(max_legs + 1):
+            forward_legs = (legs + 1) // 2
+            for (prefix_legs, hub), prefixes in forward.items():
+                if prefix_legs != forward_legs or (legs - forward_legs, hub) not in backward:
+                    continue
+                # Reversed node chains run hub -> destination once un-reversed by _node_path.
+                suffixes = [(self._node_path(node)[::-1], distance) for node, distance in backward[(legs - forward_legs, hub)]]
+                for node, prefix_distance in prefixes:
+                    prefix = self._node_path(node)
+                    prefix_airports = set(prefix)
+                    for suffix, suffix_distance in suffixes:
+                        if prefix_airports.isdisjoint(suffix[1:]):
+                            yield self.vertices[prefix + suffix[1:]], legs, prefix_distance + suffix_distance
+
+    def _bfs(self, start, destination, max_layovers, bidirectional, stats=None):
+        if not bidirectional:
+            return np.array(list(self.iter_routes(start, destination, max_layovers, stats)), dtype=ROUTE_DTYPE)
+        start_index = self._get_vertex_index(start)
+        destination_index = self._get_vertex_index(destination)
+        if start_index == -1 or destination_index == -1:
+            return np.array([], dtype=ROUTE_DTYPE)
+        return np.array(list(self._bidirectional_routes(start_index, destination_index, max_layovers + 1, stats)), dtype=ROUTE_DTYPE)
+
+    def bfs(self, start, destination, max_layovers, bidirectional=False):
+        if not METRICS.enabled:
+            return self._bfs(start, destination, max_layovers, bidirectional)
+        started = time.perf_counter()
+        stats = [0, 0]
+        routes = self._bfs(start, destination, max_layovers, bidirectional, stats)
+        METRICS.increment('graph_bfs_queries_total')
+        METRICS.increment('graph_bfs_paths_emitted_total', routes.size)
+        METRICS.increment('graph_bfs_nodes_expanded_total', stats[0])
+        METRICS.set_gauge('graph_bfs_frontier_peak', stats[1])
+        METRICS.max_gauge('graph_bfs_frontier_peak_max', stats[1])
+        METRICS.observe('graph_bfs_seconds', time.perf_counter() - started)
         return routes
 
-class HashTable:
-    def __init__(self, size):
+    def batch_routes(self, queries):
+        # Queries sharing an origin are answered by one layered expansion to the largest
+        # layover limit among them; each popped path is handed to every query it satisfies.
+        by_origin = {}
+        for query, (origin, destination, max_layovers) in enumerate(queries):
+            start_index = self._get_vertex_index(str(origin))
+            destination_index = self._get_vertex_index(str(destination))
+            if start_index != -1 and destination_index != -1:
+                by_origin.setdefault(start_index, {}).setdefault(destination_index, []).append((query, int(max_layovers) + 1))
+        results = {}
+        indptr, indices, weights = self._csr()
+        for start_index, targets in by_origin.items():
+            max_legs = max(legs for wanted in targets.values() for _, legs in wanted)
+            can_reach = None
+            if self._precomputed_legs() >= max_legs:
+                columns = sorted(targets)
+                can_reach = [self.reachable[legs][:, columns].any(axis=1).tolist() for legs in range(max_legs)]
+            frontier = deque([((start_index, None), 0, 0)])
+            while frontier:
+                node, legs, distance = frontier.popleft()
+                current = node[0]
+                if current in targets:
+                    for query, query_legs in targets[current]:
+                        if legs <= query_legs:
+                            results.setdefault(query, []).append((node, legs, distance))
+                if legs >= max_legs:
+                    continue
+                for edge in range(indptr[current], indptr[current + 1]):
+                    neighbor_index = indices[edge]
+                    if neighbor_index < 0:
+                        continue
+                    if can_reach is not None and not can_reach[max_legs - legs - 1][neighbor_index]:
+                        continue
+                    visited = node
+                    while visited is not None and visited[0] != neighbor_index:
+                        visited = visited[1]
+                    if visited is None:
+                        frontier.append(((neighbor_index, node), legs + 1, distance + weights[edge]))
+
+        rows = [(query, found) for query in sorted(results) for found in results[query]]
+        routes = np.empty((len(rows),), dtype=batch_route_dtype(self.vertices.dtype))
+        if rows:
+            paths = [self._node_path(node) for _, (node, _, _) in rows]
+            routes['query'] = [query for query, _ in rows]
+            routes['origin'] = self.vertices[[path[0] for path in paths]]
+            routes['destination'] = self.vertices[[path[-1] for path in paths]]
+            path_column = np.empty((len(paths),), dtype=object)
+            for row, path in enumerate(paths):
+                path_column[row] = self.vertices[path]
+            routes['path'] = path_column
+            routes['layovers'] = [legs for _, (_, legs, _) in rows]
+            routes['distance'] = [distance for _, (_, _, distance) in rows]
+        return routes
+
+    def parallel_routes(self, queries, workers=None):
+        with RoutePool(self, workers) as pool:
+            return pool.batch_routes(queries)
+
+    def parallel_bfs(self, start, destination, max_layovers, workers=None):
+        with RoutePool(self, workers) as pool:
+            return pool.bfs(start, destination, max_layovers)
+
+    def find_routes(self, start, destination, max_layovers, sort_by='distance', limit=None):
+        key = (start, destination, max_layovers, sort_by, limit)
+        routes = self.route_cache.get(key, self.version)
+        if routes is not None:
+            return routes
+        if sort_by == 'distance':
+            routes = np.array(list(self.k_shortest_routes(start, destination, limit, max_layovers)), dtype=ROUTE_DTYPE)
+        else:
+            routes = self.bfs(start, destination, max_layovers, bidirectional=True)
+            ranking = ('layovers', 'distance')
+            routes = RouteRanking.sort(routes, ranking) if limit is None else RouteRanking.top_k(routes, limit, ranking)
+        routes.flags.writeable = False
+        self.route_cache.put(key, self.version, routes)
+        return routes
+
+    def fingerprint(self):
+        self.compact()
+        digest = hashlib.sha1(self.vertices[:self.vertex_count].tobytes())
+        for array in (self.indptr, self.indices, self.weights, np.array(sorted(self.removed), dtype=int)):
+            digest.update(np.ascontiguousarray(array, dtype=np.int64).tobytes())
+        return digest.hexdigest()
+
+    def precompute(self, max_layovers, block_elements=1 << 24):
+        # leg_distances[k][i, j] is the cheapest distance from i to j using at most k legs.
+        # Each layer is a min-plus product of the previous one with the weight matrix, taken
+        # over the edge list (grouped by destination) in row blocks of bounded size.
+        self.compact()
+        n = self.vertex_count
+        active = np.ones((n,), dtype=bool)
+        active[[index for index in self.removed if index < n]] = False
+        sources = np.repeat(np.arange(self.num_vertices), np.diff(self.indptr))
+        keep = active[sources] & active[self.indices]
+        order = np.argsort(self.indices[keep], kind='stable')
+        sources, destinations, weights = sources[keep][order], self.indices[keep][order], self.weights[keep][order]
+        targets, starts = np.unique(destinations, return_index=True)
+
+        max_legs = max_layovers + 1
+        distances = np.full((max_legs + 1, n, n), np.inf)
+        distances[0][np.flatnonzero(active), np.flatnonzero(active)] = 0
+        block = max(1, block_elements // max(1, sources.size))
+        for legs in range(1, max_legs + 1):
+            distances[legs] = distances[legs - 1]
+            if sources.size == 0:
+                continue
+            for row in range(0, n, block):
+                candidates = distances[legs - 1][row:row + block][:, sources] + weights
+                extended = np.minimum.reduceat(candidates, starts, axis=1)
+                distances[legs][row:row + block, targets] = np.minimum(distances[legs][row:row + block, targets], extended)
+        self.leg_distances = distances
+        self.reachable = np.isfinite(distances)
+        self._precomputed = (self.version, max_legs)
+
+    def _precomputed_legs(self):
+        precomputed = getattr(self, '_precomputed', None)
+        if precomputed is None or precomputed[0] != self.version:
+            return -1
+        return precomputed[1]
+
+    def _reach_lists(self, destination_index, max_legs):
+        if self._precomputed_legs() < max_legs:
+            return None
+        return [self.reachable[legs][:, destination_index].tolist() for legs in range(max_legs)]
+
+    def min_distance(self, start, destination, max_layovers):
+        start_index = self._get_vertex_index(start)
+        destination_index = self._get_vertex_index(destination)
+        if start_index == -1 or destination_index == -1:
+            return None
+        if self._precomputed_legs() >= max_layovers + 1:
+            distance = self.leg_distances[max_layovers + 1][start_index, destination_index]
+            return int(distance) if np.isfinite(distance) else None
+        routes = self.shortest_path(start, destination, max_layovers)
+        return int(routes[0]['distance']) if routes.size > 0 else None
+
+    def has_route(self, start, destination, max_layovers):
+        return self.min_distance(start, destination, max_layovers) is not None
+
+    def save_precomputed(self, filename):
+        if self._precomputed_legs() == -1:
+            print("Nothing precomputed for the current graph.")
+            return
+        np.savez_compressed(filename, leg_distances=self.leg_distances, fingerprint=np.array(self.fingerprint()))
+
+    def load_precomputed(self, filename):
+        try:
+            with np.load(filename) as data:
+                if str(data['fingerprint']) != self.fingerprint():
+                    print(f"Precomputed matrices in {filename} belong to a different network.")
+                    return False
+                self.leg_distances = data['leg_distances']
+        except Exception as e:
+            print(f"Error reading file {filename}: {e}")
+            return False
+        self.reachable = np.isfinite(self.leg_distances)
+        self._precomputed = (self.version, self.leg_distances.shape[0] - 1)
+        return True
+
+    def _heuristic(self, destination_index):
+        # Great-circle distance to the destination; airports without coordinates fall back to 0.
+        target = self.coordinates[destination_index]
+        if np.isnan(target).any():
+            return None
+        estimate = great_circle_distance(self.coordinates[:, 0], self.coordinates[:, 1], target[0], target[1])
+        return np.nan_to_num(estimate, nan=0.0).tolist()
+
+    def _shortest_edges(self, start_index, destination_index, max_legs=None, banned_vertices=frozenset(), banned_edges=frozenset(), estimate=None, stats=None):
+        # stats, when given, collects [states expanded, peak heap size, searches run].
+        indptr, indices, weights = self._csr()
+        if stats is not None:
+            stats[2] += 1
+
+        # With a layover limit the search runs over (airport, legs) states. A popped state is
+        # dominated when its airport was already expanded with no more legs and no more
+        # distance; a cheaper state that reopens the airport (possible under A* when some
+        # airports lack coordinates) is expanded again.
+        expanded = {}
+        best = {(start_index, 0): 0}
+        parent = {(start_index, 0): None}
+        heap = [(estimate[start_index] if estimate else 0, 0, 0, start_index)]
+        while heap:
+            if stats is not None:
+                stats[1] = max(stats[1], len(heap))
+            _, legs, distance, current = heapq.heappop(heap)
+            state = (current, legs if max_legs is not None else 0)
+            if distance > best[state]:
+                continue
+            labels = expanded.setdefault(current, [])
+            if any(settled_legs <= legs and settled_distance <= distance for settled_legs, settled_distance in labels):
+                continue
+            labels.append((legs, distance))
+            if stats is not None:
+                stats[0] += 1
+
+            if current == destination_index:
+                edges = []
+                while parent[state] is not None:
+                    state, edge = parent[state]
+                    edges.append(edge)
+                edges.reverse()
+                return distance, edges
+
+            if max_legs is not None and legs >= max_legs:
+                continue
+            for edge in range(indptr[current], indptr[current + 1]):
+                neighbor_index = indices[edge]
+                if neighbor_index < 0 or neighbor_index in banned_vertices or edge in banned_edges:
+                    continue
+                new_distance = distance + weights[edge]
+                new_state = (neighbor_index, legs + 1 if max_legs is not None else 0)
+                if new_distance < best.get(new_state, new_distance + 1):
+                    best[new_state] = new_distance
+                    parent[new_state] = (state, edge)
+                    priority = new_distance + (estimate[neighbor_index] if estimate else 0)
+                    heapq.heappush(heap, (priority, legs + 1, new_distance, neighbor_index))
+        return None
+
+    def _edge_path(self, start_index, edges):
+        indices = self._csr()[1]
+        return [start_index] + [indices[edge] for edge in edges]
+
+    def _record_search(self, name, stats, emitted, elapsed):
+        METRICS.increment(f'{name}_queries_total')
+        METRICS.increment(f'{name}_searches_total', stats[2])
+        METRICS.increment(f'{name}_nodes_expanded_total', stats[0])
+        METRICS.increment(f'{name}_routes_emitted_total', emitted)
+        METRICS.set_gauge(f'{name}_heap_peak', stats[1])
+        METRICS.max_gauge(f'{name}_heap_peak_max', stats[1])
+        METRICS.observe(f'{name}_seconds', elapsed)
+
+    def shortest_path(self, start, destination, max_layovers=None, heuristic=False):
+        started = time.perf_counter()
+        stats = [0, 0, 0] if METRICS.enabled else None
+        routes = self._shortest_path(start, destination, max_layovers, heuristic, stats)
+        if stats is not None:
+            self._record_search('graph_shortest_path', stats, routes.size, time.perf_counter() - started)
+        return routes
+
+    def _shortest_path(self, start, destination, max_layovers, heuristic, stats):
+        start_index = self._get_vertex_index(start)
+        destination_index = self._get_vertex_index(destination)
+        if start_index == -1 or destination_index == -1:
+            return np.array([], dtype=ROUTE_DTYPE)
+        max_legs = None if max_layovers is None else max_layovers + 1
+        estimate = self._heuristic(destination_index) if heuristic else None
+        result = self._shortest_edges(start_index, destination_index, max_legs, estimate=estimate, stats=stats)
+        if result is None:
+            return np.array([], dtype=ROUTE_DTYPE)
+        distance, edges = result
+        return np.array([(self.vertices[self._edge_path(start_index, edges)], len(edges), distance)], dtype=ROUTE_DTYPE)
+
+    def k_shortest_routes(self, start, destination, k=None, max_layovers=None):
+        if not METRICS.enabled:
+            yield from self._k_shortest_routes(start, destination, k, max_layovers)
+            return
+        # Only the time spent producing routes is measured, not the caller's time between them.
+        stats = [0, 0, 0]
+        emitted = 0
+        elapsed = 0.0
+        routes = self._k_shortest_routes(start, destination, k, max_layovers, stats)
+        try:
+            while True:
+                started = time.perf_counter()
+                route = next(routes, None)
+                elapsed += time.perf_counter() - started
+                if route is None:
+                    return
+                emitted += 1
+                yield route
+        finally:
+            self._record_search('graph_k_shortest', stats, emitted, elapsed)
+
+    def _k_shortest_routes(self, start, destination, k, max_layovers, stats=None):
+        # Yen's algorithm over edge sequences, so parallel routes between two airports stay distinct.
+        start_index = self._get_vertex_index(start)
+        destination_index = self._get_vertex_index(destination)
+        if start_index == -1 or destination_index == -1:
+            return
+        weights = self._csr()[2]
+        max_legs = None if max_layovers is None else max_layovers + 1
+        first = self._shortest_edges(start_index, destination_index, max_legs, stats=stats)
+        if first is None:
+            return
+        accepted = []
+        candidates = []
+        seen = {tuple(first[1])}
+        distance, edges = first
+        while True:
+            accepted.append(edges)
+            path = self._edge_path(start_index, edges)
+            yield self.vertices[path], len(edges), distance
+            if k is not None and len(accepted) >= k:
+                return
+
+            root_distance = 0
+            for i in range(len(edges)):
+                root = edges[:i]
+                banned_edges = {other[i] for other in accepted if len(other) > i and other[:i] == root}
+                remaining_legs = None if max_legs is None else max_legs - i
+                spur = self._shortest_edges(path[i], destination_index, remaining_legs, frozenset(path[:i]), banned_edges, stats=stats)
+                if spur is not None:
+                    candidate = tuple(root + spur[1])
+                    if candidate not in seen:
+                        seen.add(candidate)
+                        heapq.heappush(candidates, (root_distance + spur[0], len(candidate), candidate))
+                root_distance += weights[edges[i]]
+
+            if not candidates:
+                return
+            distance, _, candidate = heapq.heappop(candidates)
+            edges = list(candidate)
+
+def parse_time(value):
+    # 'HH:MM' or minutes after midnight; times past 24:00 are allowed for the following day.
+    if isinstance(value, str):
+        hours, minutes = (int(part) for part in value.strip().split(':'))
+        if hours < 0 or not 0 <= minutes < 60:
+            raise ValueError(f"invalid time {value!r}")
+        value = hours * 60 + minutes
+    return int(value)
+
+def format_time(minutes):
+    day, minutes = divmod(int(minutes), MINUTES_PER_DAY)
+    return f"{minutes // 60:02d}:{minutes % 60:02d}" + (f" (+{day})" if day else "")
+
+class FlightSchedule:
+    # Timetable layer over a Graph's airport indices. Flights are sorted by origin, then
+    # destination, then departure, so each airport's timetable is a run of routes and each
+    # route a sorted run of departures. The schedule repeats daily.
+    def __init__(self, graph, min_connection=45):
+        self.graph = graph
+        self.min_connection = min_connection
+        self.load_errors = []
+        self._build(np.array([], dtype=int), np.array([], dtype=int), np.array([], dtype=int),
+                    np.array([], dtype=int), np.array([], dtype='U8'))
+
+    def load_csv(self, filename):
+        # Rows are origin,destination,departure,arrival[,flight] with HH:MM times; an arrival
+        # earlier than the departure lands the next day. Returns the number of flights loaded.
+        self.load_errors = []
+        rows = []
+        try:
+            with open(filename, 'r') as file:
+                for line_number, line in enumerate(file, 1):
+                    fields = [field.strip() for field in line.strip().split(',')]
+                    if fields == ['']:
+                        continue
+                    if len(fields) not in (4, 5):
+                        self.load_errors.append((line_number, f"expected 4 or 5 fields, got {len(fields)}"))
+                        continue
+                    origin = self.graph._get_vertex_index(fields[0])
+                    destination = self.graph._get_vertex_index(fields[1])
+                    if origin == -1 or destination == -1:
+                        unknown = fields[0] if origin == -1 else fields[1]
+                        self.load_errors.append((line_number, f"unknown airport {unknown!r}"))
+                        continue
+                    try:
+                        departure, arrival = parse_time(fields[2]), parse_time(fields[3])
+                    except ValueError:
+                        self.load_errors.append((line_number, f"invalid time in {fields[2]!r}, {fields[3]!r}"))
+                        continue
+                    if arrival < departure:
+                        arrival += MINUTES_PER_DAY
+                    flight = fields[4] if len(fields) == 5 else ''
+                    rows.append((origin, destination, departure % MINUTES_PER_DAY,
+                                 departure % MINUTES_PER_DAY + arrival - departure, flight))
+        except Exception as e:
+            print(f"Error reading file {filename}: {e}")
+        if rows:
+            origins, destinations, departures, arrivals, flights = zip(*rows)
+            self._build(np.concatenate([self.origins, origins]), np.concatenate([self.destinations, destinations]),
+                        np.concatenate([self.departures, departures]), np.concatenate([self.arrivals, arrivals]),
+                        np.concatenate([self.flights, np.array(flights, dtype='U8')]))
+        if self.load_errors:
+            print(f"Skipped {len(self.load_errors)} row(s) in {filename}.")
+            for line_number, reason in self.load_errors[:10]:
+                print(f"  line {line_number}: {reason}")
+        return len(rows)
+
+    def _build(self, origins, destinations, departures, arrivals, flights):
+        order = np.lexsort((departures, destinations, origins))
+        self.origins, self.destinations = origins[order].astype(INDEX_DTYPE), destinations[order].astype(INDEX_DTYPE)
+        self.departures, self.arrivals, self.flights = departures[order].astype(np.int32), arrivals[order].astype(np.int32), flights[order]
+        size = order.size
+        # A route is a run of flights with the same origin and destination.
+        first = np.r_[True, (np.diff(self.origins) != 0) | (np.diff(self.destinations) != 0)][:size]
+        starts = np.flatnonzero(first)
+        route_ids = np.cumsum(first) - 1
+        self.flight_ptr = np.r_[starts, size]
+        self.route_origins = self.origins[starts]
+        self.route_destinations = self.destinations[starts]
+        self.route_ptr = np.zeros((self.graph.num_vertices + 1,), dtype=int)
+        np.cumsum(np.bincount(self.origins[starts], minlength=self.graph.num_vertices), out=self.route_ptr[1:])
+        # best[i] is the flight with the earliest arrival among those of its route departing
+        # at or after flight i, found by a reversed running minimum. The route id is added to
+        # the key so the minimum restarts at each route boundary.
+        span = int(self.arrivals.max()) + 1 if size else 1
+        key = (route_ids * span + self.arrivals) * max(1, size) + np.arange(size)
+        self.best = np.minimum.accumulate(key[::-1])[::-1] % max(1, size)
+        self._timetable = None
+
+    def _lists(self):
+        if self._timetable is None:
+            self._timetable = (self.route_ptr.tolist(), self.flight_ptr.tolist(), self.route_destinations.tolist(),
+                               self.departures.tolist(), self.arrivals.tolist(), self.best.tolist())
+        return self._timetable
+
+    def _reach_lists(self, destination_index, max_legs):
+        # can_reach[k][v]: airport v can get to the destination in at most k more legs,
+        # ignoring times. Without a leg limit there is one entry, iterated to a fixpoint.
+        open_airports = np.ones((self.route_ptr.size - 1,), dtype=bool)
+        open_airports[[index for index in self.graph.removed if index < open_airports.size]] = False
+        reach = np.zeros_like(open_airports)
+        if destination_index < reach.size:
+            reach[destination_index] = True
+        levels = [reach]
+        while max_legs is None or len(levels) < max_legs:
+            reach = reach.copy()
+            reach[self.route_origins[levels[-1][self.route_destinations]]] = True
+            reach &= open_airports
+            if max_legs is None and np.array_equal(reach, levels[-1]):
+                break
+            levels.append(reach)
+        return [level.tolist() for level in levels[-1:]] if max_legs is None else [level.tolist() for level in levels]
+
+    def earliest_arrival(self, origin, destination, depart_after, max_layovers=None):
+        # Time-dependent Dijkstra over (airport, legs) states keyed by arrival time. Each route
+        # out of an airport costs one binary search over its departures, with the minimum
+        # connection time added after every leg but the first.
+        start_index = self.graph._get_vertex_index(origin)
+        destination_index = self.graph._get_vertex_index(destination)
+        if start_index == -1 or destination_index == -1:
+            return np.array([], dtype=leg_dtype(self.graph.vertices.dtype))
+        route_ptr, flight_ptr, route_destinations, departures, arrivals, best = self._lists()
+        max_legs = None if max_layovers is None else max_layovers + 1
+        can_reach = self._reach_lists(destination_index, max_legs)
+        depart_after = parse_time(depart_after)
+
+        fewest_legs = {}
+        earliest = {(start_index, 0): depart_after}
+        parent = {(start_index, 0): None}
+        heap = [(depart_after, 0, start_index)]
+        while heap:
+            arrived, legs, current = heapq.heappop(heap)
+            state = (current, legs if max_legs is not None else 0)
+            if arrived > earliest[state] or fewest_legs.get(current, legs + 1) <= legs:
+                continue
+            fewest_legs[current] = legs
+
+            if current == destination_index:
+                flights = []
+                while parent[state] is not None:
+                    state, flight, day = parent[state]
+                    flights.append((flight, day))
+                flights.reverse()
+                return self._itinerary(flights)
+
+            if (max_legs is not None and legs >= max_legs) or current + 1 >= len(route_ptr):
+                continue
+            day, ready = divmod(arrived + (self.min_connection if legs else 0), MINUTES_PER_DAY)
+            reachable = can_reach[max_legs - legs - 1 if max_legs is not None else 0]
+            for route in range(route_ptr[current], route_ptr[current + 1]):
+                neighbor_index = route_destinations[route]
+                if not reachable[neighbor_index]:
+                    continue
+                low, high = flight_ptr[route], flight_ptr[route + 1]
+                # Tomorrow's best flight can still beat a late departure today.
+                flight, flight_day = best[low], day + 1
+                position = bisect.bisect_left(departures, ready, low, high)
+                if position < high and arrivals[best[position]] <= arrivals[flight] + MINUTES_PER_DAY:
+                    flight, flight_day = best[position], day
+                arrival = flight_day * MINUTES_PER_DAY + arrivals[flight]
+                new_state = (neighbor_index, legs + 1 if max_legs is not None else 0)
+                if arrival < earliest.get(new_state, arrival + 1):
+                    earliest[new_state] = arrival
+                    parent[new_state] = (state, flight, flight_day)
+                    heapq.heappush(heap, (arrival, legs + 1, neighbor_index))
+        return np.array([], dtype=leg_dtype(self.graph.vertices.dtype))
+
+    def _itinerary(self, flights):
+        legs = np.empty((len(flights),), dtype=leg_dtype(self.graph.vertices.dtype))
+        if flights:
+            rows = np.array([flight for flight, _ in flights], dtype=int)
+            days = np.array([day for _, day in flights], dtype=int) * MINUTES_PER_DAY
+            legs['flight'] = self.flights[rows]
+            legs['origin'] = self.graph.vertices[self.origins[rows]]
+            legs['destination'] = self.graph.vertices[self.destinations[rows]]
+            legs['departure'] = self.departures[rows] + days
+            legs['arrival'] = self.arrivals[rows] + days
+        return legs
+
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+MASK64 = 0xffffffffffffffff
+TOMBSTONE = ('', None)
+EMPTY, FULL, DELETED = 0, 1, 2
+
+def hash_many(keys):
+    # Vectorized HashTable._hash over a fixed-width bytes ('S') array; uint64 arithmetic wraps like MASK64.
+    width = keys.dtype.itemsize
+    data = np.ascontiguousarray(keys).view(np.uint8).reshape(keys.size, width)
+    lengths = np.char.str_len(keys).reshape(-1)
+    h = np.full((keys.size,), FNV_OFFSET, dtype=np.uint64)
+    for column in range(width):
+        h = np.where(lengths > column, (h ^ data[:, column]) * np.uint64(FNV_PRIME), h)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xff51afd7ed558ccd)
+    h ^= h >> np.uint64(33)
+    return h
+
+class CompactSlots:
+    # Columnar slot storage: fixed-width key bytes, a state byte per slot, and values
+    # kept as (offset, length) into one UTF-8 arena. Indexing returns the same
+    # None / TOMBSTONE / (key, value) items as the object-array table.
+    def __init__(self, size, key_width=3):
         self.size = size
-        self.table = np.empty((size,), dtype=object)
+        self.key_width = key_width
+        self.keys = np.zeros((size,), dtype=f'S{key_width}')
+        self.states = np.zeros((size,), dtype=np.uint8)
+        self.value_offsets = np.zeros((size,), dtype=np.int64)
+        self.value_lengths = np.zeros((size,), dtype=np.uint32)
+        self.arena = np.zeros((max(64, size * 16),), dtype=np.uint8)
+        self.arena_used = 0
+        # Bytes of the arena still referenced by occupied slots; the rest of arena_used is dead.
+        self.arena_live = 0
+
+    def encode_key(self, key):
+        encoded = key.encode()
+        if len(encoded) > self.key_width or b'\x00' in encoded:
+            raise ValueError(f"Key {key!r} does not fit a {self.key_width}-byte compact slot")
+        return encoded
+
+    def _store_value(self, index, value):
+        encoded = str(value).encode()
+        if self.states[index] == FULL:
+            # An overwrite that fits reuses the slot's bytes; otherwise they become dead.
+            if len(encoded) <= self.value_lengths[index]:
+                offset = int(self.value_offsets[index])
+                self.arena[offset:offset + len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+                self.arena_live -= int(self.value_lengths[index]) - len(encoded)
+                self.value_lengths[index] = len(encoded)
+                return
+            self._release_value(index)
+        if self.arena_used + len(encoded) > self.arena.size:
+            self.arena = np.resize(self.arena, max(2 * self.arena.size, self.arena_used + len(encoded)))
+        self.arena[self.arena_used:self.arena_used + len(encoded)] = np.frombuffer(encoded, dtype=np.uint8)
+        self.value_offsets[index] = self.arena_used
+        self.value_lengths[index] = len(encoded)
+        self.arena_used += len(encoded)
+        self.arena_live += len(encoded)
+
+    def _release_value(self, index):
+        self.arena_live -= int(self.value_lengths[index])
+        self.value_lengths[index] = 0
+        if self.arena_used - self.arena_live > max(self.arena_live, 64):
+            self.compact_arena()
+
+    def compact_arena(self):
+        # Copies the live values to the front of a fresh arena, in slot order.
+        full = np.flatnonzero(self.states == FULL)
+        lengths = self.value_lengths[full].astype(np.int64)
+        offsets = np.zeros((full.size,), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        arena = np.zeros((max(64, 2 * int(lengths.sum())),), dtype=np.uint8)
+        if full.size:
+            # Source byte positions for every live byte: each value's start plus 0..length-1.
+            starts = np.repeat(self.value_offsets[full] - offsets, lengths)
+            arena[:lengths.sum()] = self.arena[starts + np.arange(lengths.sum())]
+        self.value_offsets[full] = offsets
+        self.arena = arena
+        self.arena_used = self.arena_live = int(lengths.sum())
+
+    def value(self, index):
+        offset = int(self.value_offsets[index])
+        return self.arena[offset:offset + int(self.value_lengths[index])].tobytes().decode()
+
+    def __getitem__(self, index):
+        state = self.states[index]
+        if state == EMPTY:
+            return None
+        if state == DELETED:
+            return TOMBSTONE
+        return self.keys[index].decode(), self.value(index)
+
+    def __setitem__(self, index, item):
+        if item is None or item is TOMBSTONE:
+            if self.states[index] == FULL:
+                self.states[index] = EMPTY
+                self._release_value(index)
+            self.states[index] = EMPTY if item is None else DELETED
+        else:
+            self.keys[index] = self.encode_key(item[0])
+            self._store_value(index, item[1])
+            self.states[index] = FULL
+
+    def __iter__(self):
+        for index in range(self.size):
+            yield self[index]
+
+    def find(self, h, key):
+        encoded = key.encode()
+        if len(encoded) > self.key_width:
+            return -1, 1
+        mask = self.size - 1
+        index = h & mask
+        probe_count = 0
+        while self.states[index] != EMPTY:
+            if self.states[index] == FULL and self.keys[index] == encoded:
+                return index, probe_count + 1
+            probe_count += 1
+            index = (index + probe_count) & mask
+        return -1, probe_count + 1
+
+    def free_slot(self, h):
+        mask = self.size - 1
+        index = h & mask
+        probe_count = 0
+        while self.states[index] == FULL:
+            probe_count += 1
+            index = (index + probe_count) & mask
+        return index
+
+    def find_many(self, hashes, keys):
+        # Every unresolved key advances one probe per round.
+        mask = np.uint64(self.size - 1)
+        slots = np.full((keys.size,), -1, dtype=np.int64)
+        pending = np.arange(keys.size)
+        index = (hashes & mask).astype(np.int64)
+        probe_count = 0
+        while pending.size > 0:
+            states = self.states[index]
+            found = (states == FULL) & (self.keys[index] == keys[pending])
+            slots[pending[found]] = index[found]
+            keep = ~found & (states != EMPTY)
+            probe_count += 1
+            pending, index = pending[keep], (index[keep] + probe_count) & int(mask)
+        return slots
+
+class SharedGraph:
+    # Copies the graph arrays into shared memory once; workers attach to them by name.
+    FIELDS = ('vertices', 'indptr', 'indices', 'weights')
+
+    def __init__(self, graph):
+        graph.compact()
+        arrays = {name: getattr(graph, name) for name in self.FIELDS}
+        arrays['removed'] = np.array(sorted(graph.removed), dtype=int)
+        self.blocks = []
+        self.spec = {'num_vertices': graph.num_vertices, 'vertex_count': graph.vertex_count, 'arrays': {}}
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            self.blocks.append(block)
+            self.spec['arrays'][name] = (block.name, array.dtype.str, array.shape)
+
+    @staticmethod
+    def attach(spec):
+        blocks = []
+        graph = Graph(0)
+        graph.num_vertices = spec['num_vertices']
+        graph.vertex_count = spec['vertex_count']
+        arrays = {}
+        for name, (block_name, dtype, shape) in spec['arrays'].items():
+            block = shared_memory.SharedMemory(name=block_name)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        for name in SharedGraph.FIELDS:
+            setattr(graph, name, arrays[name])
+        graph.removed = set(arrays['removed'].tolist())
+        graph._index_vertices()
+        # The traversal loops only index the CSR arrays, so they read the shared blocks through
+        # memoryviews instead of each worker building private lists of every edge.
+        graph._adjacency = tuple(memoryview(arrays[name]) for name in ('indptr', 'indices', 'weights'))
+        return graph, blocks
+
+    def close(self):
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+_worker_graph = None
+_worker_blocks = None
+
+def _attach_worker(spec):
+    global _worker_graph, _worker_blocks
+    _worker_graph, _worker_blocks = SharedGraph.attach(spec)
+
+def _worker_batch(queries):
+    return _worker_graph.batch_routes(queries)
+
+def _worker_subtree(start_index, destination_index, max_legs, edge):
+    graph = _worker_graph
+    indptr, indices, weights = graph._csr()
+    initial = ((indices[edge], (start_index, None)), 1, weights[edge])
+    return [(graph.vertices[graph._node_path(node)], legs, distance)
+            for node, legs, distance in graph._iter_paths(start_index, destination_index, max_legs, initial)]
+
+class RoutePool:
+    # Process pool over a SharedGraph snapshot; later changes to the graph are not seen by the workers.
+    def __init__(self, graph, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.shared = SharedGraph(graph)
+        self.graph = graph
+        self.executor = ProcessPoolExecutor(self.workers, initializer=_attach_worker, initargs=(self.shared.spec,))
+
+    def batch_routes(self, queries, chunks_per_worker=4):
+        # Whole origin groups go to one chunk so each worker still shares their expansion.
+        groups = {}
+        for query, (origin, destination, max_layovers) in enumerate(queries):
+            groups.setdefault(str(origin), []).append((query, (str(origin), str(destination), int(max_layovers))))
+        chunk_count = max(1, min(len(groups), self.workers * chunks_per_worker))
+        chunks = [[] for _ in range(chunk_count)]
+        for position, group in enumerate(sorted(groups.values(), key=len, reverse=True)):
+            chunks[position % chunk_count].extend(group)
+        futures = [(np.array([query for query, _ in chunk], dtype=int), self.executor.submit(_worker_batch, [item for _, item in chunk]))
+                   for chunk in chunks if chunk]
+        parts = []
+        for query_ids, future in futures:
+            routes = future.result()
+            routes['query'] = query_ids[routes['query']]
+            parts.append(routes)
+        if not parts:
+            return np.empty((0,), dtype=batch_route_dtype(self.graph.vertices.dtype))
+        routes = np.concatenate(parts)
+        return routes[np.argsort(routes['query'], kind='stable')]
+
+    def bfs(self, start, destination, max_layovers):
+        # Each first leg is an independent subtree. BFS order is by layovers, then by first
+        # leg, so a stable sort of the concatenated subtrees restores the bfs order exactly.
+        start_index = self.graph._get_vertex_index(start)
+        destination_index = self.graph._get_vertex_index(destination)
+        if start_index == -1 or destination_index == -1:
+            return np.array([], dtype=ROUTE_DTYPE)
+        if start_index == destination_index or max_layovers < 0:
+            return self.graph.bfs(start, destination, max_layovers)
+        indptr, indices, _ = self.graph._csr()
+        edges = [edge for edge in range(indptr[start_index], indptr[start_index + 1])
+                 if indices[edge] >= 0 and indices[edge] != start_index]
+        futures = [self.executor.submit(_worker_subtree, start_index, destination_index, max_layovers + 1, edge) for edge in edges]
+        routes = np.array([route for future in futures for route in future.result()], dtype=ROUTE_DTYPE)
+        return routes[np.argsort(routes['layovers'], kind='stable')]
+
+    def close(self):
+        self.executor.shutdown()
+        self.shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class HashTable:
+    def __init__(self, size, rehash_step=16, compact=False, key_width=3):
+        # Power-of-two capacity lets quadratic probing reach every slot.
+        self.size = 1 << max(0, size - 1).bit_length()
+        self.compact = compact
+        self.key_width = key_width
+        self.table = self._new_table(self.size)
         self.item_count = 0
+        self.used_count = 0
+        self.tombstone_count = 0
+        # While resizing, keys still in old_table move over rehash_step slots per operation.
+        self.rehash_step = rehash_step
+        self.old_table = None
+        self.rehash_index = 0
+
+    def _new_table(self, size):
+        if self.compact:
+            return CompactSlots(size, self.key_width)
+        return np.empty((size,), dtype=object)
+
+    def _hash(self, key):
+        # FNV-1a over the key bytes, then a 64-bit finalizer so the low bits depend on every byte.
+        h = FNV_OFFSET
+        for byte in key.encode():
+            h = ((h ^ byte) * FNV_PRIME) & MASK64
+        h ^= h >> 33
+        h = (h * 0xff51afd7ed558ccd) & MASK64
+        h ^= h >> 33
+        return h
 
     def hash_function(self, key):
-        sum_ascii = np.sum(np.frombuffer(key.encode(), dtype=np.uint8))
-        return int(sum_ascii % self.size)
-    
-    def linear_probe(self, index, probe_count):
-        return int((index + probe_count) % self.size)
+        return self._hash(key) & (self.size - 1)
 
-    def insert(self, key, value):
-        if self.item_count + 1 > 0.75 * self.size:
-            self.resize(self.size * 2)
+    def quadratic_probe(self, index, probe_count):
+        # Offsets grow as 1, 2, 3, ... giving triangular-number probing.
+        return (index + probe_count) & (self.size - 1)
 
-        index = self.hash_function(key)
+    def _find_in(self, table, h, key):
+        if self.compact:
+            return table.find(h, key)
+        mask = table.size - 1
+        index = h & mask
         probe_count = 0
-        while self.table[index] is not None and self.table[index][0] != key:
+        while table[index] is not None:
+            if table[index] is not TOMBSTONE and table[index][0] == key:
+                return index, probe_count + 1
             probe_count += 1
-            index = self.linear_probe(index, probe_count)
-        if self.table[index] is None:
-            self.item_count += 1
+            index = (index + probe_count) & mask
+        return -1, probe_count + 1
+
+    def _find(self, key):
+        h = self._hash(key)
+        index, probes = self._find_in(self.table, h, key)
+        if index == -1 and self.old_table is not None:
+            old_index, old_probes = self._find_in(self.old_table, h, key)
+            if old_index != -1:
+                return self.old_table, old_index, probes + old_probes
+        return self.table, index, probes
+
+    def _place(self, h, key, value):
+        # Puts a key known to be absent from self.table into the first free or tombstone slot.
+        if self.compact:
+            index = self.table.free_slot(h)
+        else:
+            index = h & (self.size - 1)
+            probe_count = 0
+            while self.table[index] is not None and self.table[index] is not TOMBSTONE:
+                probe_count += 1
+                index = self.quadratic_probe(index, probe_count)
+        if self.table[index] is TOMBSTONE:
+            self.tombstone_count -= 1
+        else:
+            self.used_count += 1
         self.table[index] = (key, value)
 
+    def _record_operation(self, probes):
+        METRICS.increment('hashtable_operations_total')
+        METRICS.increment('hashtable_probes_total', probes)
+        METRICS.set_gauge('hashtable_load_factor', self.item_count / self.size)
+
+    def _rehash(self, slots):
+        if METRICS.enabled:
+            started = time.perf_counter()
+        old_table = self.old_table
+        end = min(old_table.size, self.rehash_index + slots)
+        for index in range(self.rehash_index, end):
+            item = old_table[index]
+            if item is not None and item is not TOMBSTONE:
+                self._place(self._hash(item[0]), item[0], item[1])
+                old_table[index] = TOMBSTONE
+        self.rehash_index = end
+        if end == old_table.size:
+            self.old_table = None
+        if METRICS.enabled:
+            METRICS.observe('hashtable_rehash_seconds', time.perf_counter() - started)
+
+    def _old_pending(self):
+        return self.item_count - (self.used_count - self.tombstone_count)
+
+    def _rehash_pending(self):
+        if self.old_table is not None:
+            self._rehash(self.rehash_step)
+
+    def finish_rehash(self):
+        if self.old_table is not None:
+            self._rehash(self.old_table.size)
+
+    def insert(self, key, value):
+        if self.compact:
+            self.table.encode_key(key)
+        self._rehash_pending()
+        table, index, probes = self._find(key)
+        if METRICS.enabled:
+            self._record_operation(probes)
+        if index != -1 and table is self.table:
+            self.table[index] = (key, value)
+            return
+        if index != -1:
+            table[index] = TOMBSTONE
+            self.item_count -= 1
+
+        # Keys still waiting in old_table will land in self.table too, so they count toward its load.
+        if self.used_count + self._old_pending() + 1 > 0.75 * self.size:
+            self.finish_rehash()
+            if self.used_count + 1 > 0.75 * self.size:
+                # Tombstone-heavy tables are rebuilt at the same size instead of grown.
+                self.resize(self.size * 2 if self.item_count + 1 > 0.375 * self.size else self.size)
+        self._place(self._hash(key), key, value)
+        self.item_count += 1
+
     def search(self, key):
-        index = self.hash_function(key)
-        probe_count = 0
-        while self.table[index] is not None:
-            if self.table[index][0] == key:
-                return self.table[index][1]
-            probe_count += 1
-            index = self.linear_probe(index, probe_count)
-        return None
+        self._rehash_pending()
+        table, index, probes = self._find(key)
+        if METRICS.enabled:
+            self._record_operation(probes)
+        return table[index][1] if index != -1 else None
 
     def delete(self, key):
-        index = self.hash_function(key)
-        probe_count = 0
-        while self.table[index] is not None:
-            if self.table[index][0] == key:
-                self.table[index] = None
-                self.item_count -= 1
-                if self.item_count < 0.5 * self.size and self.size > 1:
-                    self.resize(max(1, self.size // 2))
-                return
-            probe_count += 1
-            index = self.linear_probe(index, probe_count)
+        self._rehash_pending()
+        table, index, probes = self._find(key)
+        if METRICS.enabled:
+            self._record_operation(probes)
+        if index == -1:
+            return
+        table[index] = TOMBSTONE
+        self.item_count -= 1
+        if table is self.table:
+            self.tombstone_count += 1
+        # Shrink only well below the 0.75 growth threshold so churn near one size cannot thrash,
+        # and to a size that stays at most half full while the next inserts arrive.
+        if self.old_table is None and self.size > 1 and self.item_count < 0.125 * self.size:
+            self.resize(max(1, 4 * self.item_count))
 
     def resize(self, new_size):
-        old_table = self.table
-        self.size = new_size
-        self.table = np.empty((new_size,), dtype=object)
-        self.item_count = 0
-        
-        for item in old_table:
-            if item is not None:
-                key, value = item
-                self.insert(key, value)
+        if METRICS.enabled:
+            METRICS.increment('hashtable_resizes_total')
+        self.finish_rehash()
+        self.old_table = self.table
+        # Never smaller than twice the stored keys, or the migration could fill every slot.
+        new_size = max(new_size, 2 * self.item_count)
+        self.size = 1 << max(0, new_size - 1).bit_length()
+        self.table = self._new_table(self.size)
+        self.used_count = 0
+        self.tombstone_count = 0
+        self.rehash_index = 0
+        self._rehash_pending()
+
+    def items(self):
+        for table in (self.table, self.old_table):
+            if table is None:
+                continue
+            for item in table:
+                if item is not None and item is not TOMBSTONE:
+                    yield item
+
+    def search_many(self, keys):
+        keys = np.asarray(keys, dtype=str)
+        if not self.compact:
+            return np.array([self.search(key) for key in keys.tolist()] + [None], dtype=object)[:-1]
+        encoded = np.char.encode(keys, 'utf-8')
+        if encoded.dtype.itemsize > self.key_width:
+            encoded = encoded.astype(f'S{self.key_width + 1}')
+        fits = np.char.str_len(encoded) <= self.key_width
+        values = np.full((keys.size,), None, dtype=object)
+        found = ~fits
+        hashes = hash_many(encoded)
+        for table in (self.table, self.old_table):
+            missing = np.flatnonzero(~found)
+            if table is None or missing.size == 0:
+                continue
+            slots = table.find_many(hashes[missing], encoded[missing].astype(table.keys.dtype))
+            for row, slot in zip(missing[slots != -1].tolist(), slots[slots != -1].tolist()):
+                values[row] = table.value(slot)
+                found[row] = True
+        return values
+
+    def probe_histogram(self):
+        # histogram[n] is the number of stored keys found on the n-th probe.
+        probes = [self._find(key)[2] for key, _ in self.items()]
+        return np.bincount(probes, minlength=2) if probes else np.zeros((2,), dtype=int)
+
+    def save(self, filename):
+        # Slot states: 0 empty, 1 occupied, 2 tombstone.
+        self.finish_rehash()
+        states = np.array([EMPTY if item is None else DELETED if item is TOMBSTONE else FULL for item in self.table], dtype=np.uint8)
+        items = list(self.items())
+        keys = np.array([key for key, _ in items], dtype=str)
+        values = [str(value).encode() for _, value in items]
+        offsets = np.zeros((len(values) + 1,), dtype=np.int64)
+        np.cumsum([len(value) for value in values], out=offsets[1:])
+        write_snapshot(filename, 'hashtable', {'size': self.size, 'item_count': self.item_count,
+                                               'compact': self.compact, 'key_width': self.key_width}, {
+            'states': states, 'keys': keys, 'value_offsets': offsets,
+            'values': np.frombuffer(b''.join(values), dtype=np.uint8)})
+
+    @classmethod
+    def load(cls, filename, mmap=True):
+        # Slots keep their positions, so nothing is rehashed on load.
+        meta, arrays = read_snapshot(filename, 'hashtable', mmap)
+        table = cls(meta['size'], compact=meta['compact'], key_width=meta['key_width'])
+        states = np.asarray(arrays['states'])
+        offsets = np.asarray(arrays['value_offsets'])
+        if table.compact:
+            # The value arena is used in place; appends after loading move it to private memory.
+            slots = table.table
+            full = np.flatnonzero(states == FULL)
+            slots.states[:] = states
+            slots.keys[full] = np.char.encode(arrays['keys'], 'utf-8')
+            slots.value_offsets[full] = offsets[:-1]
+            slots.value_lengths[full] = np.diff(offsets)
+            slots.arena = arrays['values']
+            slots.arena_used = slots.arena_live = int(offsets[-1])
+        else:
+            blob = arrays['values'].tobytes()
+            offsets = offsets.tolist()
+            for item, slot in enumerate(np.flatnonzero(states == FULL)):
+                table.table[slot] = (str(arrays['keys'][item]), blob[offsets[item]:offsets[item + 1]].decode())
+            for slot in np.flatnonzero(states == DELETED):
+                table.table[slot] = TOMBSTONE
+        table.item_count = meta['item_count']
+        table.tombstone_count = int((states == DELETED).sum())
+        table.used_count = table.item_count + table.tombstone_count
+        return table
 
 class HeapSort:
     @staticmethod
@@ -152,9 +1798,219 @@ class HeapSort:
 
         return arr
 
-def main():
-    num_vertices = 5
+class RouteService:
+    # Line-delimited JSON over TCP or a Unix socket. Requests on one connection are
+    # pipelined: up to max_in_flight run at once and replies carry the request id, so
+    # they may return out of order. Graph and table work runs on a single worker thread
+    # because neither structure is thread-safe; a timed-out request still finishes there.
+    def __init__(self, graph, airport_table, max_in_flight=32, timeout=10.0, max_line=MAX_LINE_BYTES):
+        self.graph = graph
+        self.airport_table = airport_table
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.max_line = max_line
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.operations = {
+            'find_routes': self.find_routes,
+            'lookup_airport': self.lookup_airport,
+            'add_airport': self.add_airport,
+            'delete_airport': self.delete_airport,
+            'import_csv': self.import_csv,
+            'apply_deltas': self.apply_deltas,
+        }
+
+    def find_routes(self, origin, destination, max_layovers, sort_by='distance', limit=10):
+        routes = self.graph.find_routes(origin, destination, int(max_layovers), sort_by, limit)
+        return [{'path': route['path'].tolist(), 'layovers': int(route['layovers']), 'distance': int(route['distance'])}
+                for route in routes]
+
+    def lookup_airport(self, code):
+        return self.airport_table.search(code)
+
+    def add_airport(self, code, name):
+        self.graph.add_vertex(code)
+        self.airport_table.insert(code, name)
+        return True
+
+    def delete_airport(self, code):
+        if not self.graph.remove_vertex(code):
+            return False
+        self.airport_table.delete(code)
+        return True
+
+    def import_csv(self, filename):
+        loaded = self.graph.load_csv(filename)
+        return {'loaded': loaded, 'errors': [[line, reason] for line, reason in self.graph.load_errors]}
+
+    def apply_deltas(self, events):
+        applied = self.graph.apply_deltas(events)
+        return {'applied': applied, 'errors': [[position, reason] for position, reason in self.graph.delta_errors]}
+
+    async def execute(self, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.pop('id', None)
+            operation = self.operations[request.pop('op')]
+            loop = asyncio.get_running_loop()
+            call = loop.run_in_executor(self.executor, lambda: operation(**request))
+            result = await asyncio.wait_for(call, self.timeout)
+            return {'id': request_id, 'ok': True, 'result': result}
+        except asyncio.TimeoutError:
+            return {'id': request_id, 'ok': False, 'error': f"timed out after {self.timeout} seconds"}
+        except KeyError as ke:
+            return {'id': request_id, 'ok': False, 'error': f"unknown operation or field {ke}"}
+        except Exception as e:
+            return {'id': request_id, 'ok': False, 'error': str(e)}
+
+    async def handle_connection(self, reader, writer):
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        write_lock = asyncio.Lock()
+        pending = set()
+
+        async def respond(line):
+            try:
+                if line is None:
+                    response = {'id': None, 'ok': False, 'error': f"request longer than {self.max_line} bytes"}
+                else:
+                    response = await self.execute(line)
+                async with write_lock:
+                    writer.write((json.dumps(response) + '\n').encode())
+                    await writer.drain()
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                # Stop reading once max_in_flight requests are pending; TCP flow control
+                # then pushes back on the client.
+                await in_flight.acquire()
+                line = await self._read_line(reader)
+                if line is not None and not line.strip():
+                    in_flight.release()
+                    if not line:
+                        break
+                    continue
+                task = asyncio.create_task(respond(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending, return_exceptions=True)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_line(reader):
+        # Like readline, but a line over the reader's limit is drained and returned as None
+        # so it can be answered with an error instead of dropping the connection.
+        too_long = False
+        while True:
+            try:
+                line = await reader.readuntil(b'\n')
+                return None if too_long else line
+            except asyncio.LimitOverrunError as e:
+                too_long = True
+                await reader.readexactly(e.consumed)
+            except asyncio.IncompleteReadError as e:
+                return None if too_long else e.partial
+
+    async def start(self, host='127.0.0.1', port=8765, path=None):
+        if path:
+            return await asyncio.start_unix_server(self.handle_connection, path, limit=self.max_line)
+        return await asyncio.start_server(self.handle_connection, host, port, limit=self.max_line)
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        server = await self.start(host, port, path)
+        print(f"Serving route queries on {path or f'{host}:{port}'}")
+        async with server:
+            await server.serve_forever()
+
+class RouteClient:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.next_id = 0
+        self.waiting = {}
+        self.listener = asyncio.create_task(self._listen())
+
+    @classmethod
+    async def connect(cls, host='127.0.0.1', port=8765, path=None, max_line=MAX_LINE_BYTES):
+        if path:
+            reader, writer = await asyncio.open_unix_connection(path, limit=max_line)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=max_line)
+        return cls(reader, writer)
+
+    async def _listen(self):
+        # However the connection ends, every outstanding request is failed rather than left waiting.
+        error = ConnectionError("connection closed")
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.waiting.pop(response['id'], None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (ConnectionError, ValueError, KeyError, TypeError) as e:
+            error = ConnectionError(f"connection lost: {e!r}")
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.waiting.clear()
+
+    async def request(self, op, **params):
+        if self.listener.done():
+            raise ConnectionError("connection closed")
+        self.next_id += 1
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        self.writer.write((json.dumps({'id': self.next_id, 'op': op, **params}) + '\n').encode())
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.listener.cancel()
+
+class RouteRanking:
+    # Sorts structured route arrays on whole columns. Keys are field names or positions;
+    # earlier keys take precedence and ties keep their input order.
+    @staticmethod
+    def _columns(arr, sort_by):
+        keys = sort_by if isinstance(sort_by, (tuple, list)) else (sort_by,)
+        return [arr[arr.dtype.names[key] if isinstance(key, int) else key] for key in keys]
+
+    @staticmethod
+    def order(arr, sort_by=('distance', 'layovers')):
+        columns = RouteRanking._columns(arr, sort_by)
+        return np.lexsort(columns[::-1])
+
+    @staticmethod
+    def sort(arr, sort_by=('distance', 'layovers')):
+        return arr[RouteRanking.order(arr, sort_by)]
+
+    @staticmethod
+    def top_k(arr, k, sort_by=('distance', 'layovers')):
+        if k >= arr.size:
+            return RouteRanking.sort(arr, sort_by)
+        if k <= 0:
+            return arr[:0]
+        # Partition on the first key, keep every row tied with the k-th value, then rank
+        # that small candidate set with the full key list.
+        primary = RouteRanking._columns(arr, sort_by)[0]
+        kth = primary[np.argpartition(primary, k - 1)[k - 1]]
+        candidates = np.flatnonzero(primary <= kth)
+        order = RouteRanking.order(arr[candidates], sort_by)[:k]
+        return arr[candidates[order]]
+
+def create_network(num_vertices=5):
     airline_graph = Graph(num_vertices)
+    airport_table = HashTable(6)
 
     try:
         airline_graph.add_vertex("MEL")
@@ -163,7 +2019,6 @@ def main():
         airline_graph.add_vertex("LHR")
         airline_graph.add_vertex("BKK")
 
-        airport_table = HashTable(6)
         airport_table.insert("MEL", "Melbourne Tullamarine (MEL)")
         airport_table.insert("JFK", "John F. Kennedy International Airport")
         airport_table.insert("LAX", "Los Angeles International Airport")
@@ -171,6 +2026,11 @@ def main():
         airport_table.insert("BKK", "Bangkok Suvarnabhumi Airport")
     except Exception as e:
         print(f"Error initializing data: {e}")
+    return airline_graph, airport_table
+
+def main():
+    max_routes = 10
+    airline_graph, airport_table = create_network()
 
     while True:
         try:
@@ -194,18 +2054,16 @@ def main():
                 destination = input("Enter destination airport code: ")
                 max_layovers = int(input("Enter maximum number of layovers: "))
 
-                routes = airline_graph.bfs(origin, destination, max_layovers)
+                sort_preference = input("Sort by (1) Travel Distance or (2) Number of Layovers: ")
+                if sort_preference == "1":
+                    routes = airline_graph.find_routes(origin, destination, max_layovers, 'distance', max_routes)
+                else:
+                    routes = airline_graph.find_routes(origin, destination, max_layovers, 'layovers')
 
                 if routes.size == 0:
                     print("No routes found.")
                 else:
                     print("\nAvailable Routes:")
-                    sort_preference = input("Sort by (1) Travel Distance or (2) Number of Layovers: ")
-                    if sort_preference == "1":
-                        routes = HeapSort.sort(routes, 2)
-                    else:
-                        routes = HeapSort.sort(routes, 1)
-
                     for route in routes:
                         print(f"Route: {'->'.join(route['path'])}, Layovers: {route['layovers']}, Distance: {route['distance']}")
 
@@ -229,25 +2087,22 @@ def main():
 
             elif choice == "5":
                 airport_code = input("Enter airport code: ")
-                airport_index = airline_graph._get_vertex_index(airport_code)
-                if airport_index != -1:
-                    airline_graph.vertices[airport_index] = ''
+                if airline_graph.remove_vertex(airport_code):
                     airport_table.delete(airport_code)
                 else:
                     print("Airport not found.")
 
             elif choice == "6":
                 print("Hash Table:")
-                for i, item in enumerate(airport_table.table):
-                    if item is not None:
-                        print(f"{item[0]} - {item[1]}")
+                for key, value in airport_table.items():
+                    print(f"{key} - {value}")
 
             elif choice == "7":
                 print("Graph:")
                 for i, vertex in enumerate(airline_graph.vertices):
                     print(f"Vertex {i}: {vertex}")
-                    for edge in airline_graph.adj_list[i]:
-                        print(f"-> {edge['dest']} ({edge['weight']})")
+                    for dest, weight in airline_graph.neighbors(i):
+                        print(f"-> {dest} ({weight})")
 
             elif choice == "8":
                 airport_code = input("Enter airport code: ")
@@ -274,11 +2129,17 @@ def main():
             print(f"An unexpected error occurred: {e}")
 
 if __name__ == "__main__":
-    main()
-
-
-
-
-
-
-
+    parser = argparse.ArgumentParser(description="Airline Management System")
+    parser.add_argument("--serve", action="store_true", help="run the JSON route-query service instead of the menu")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="serve on a Unix socket at this path")
+    args = parser.parse_args()
+    if args.serve:
+        airline_graph, airport_table = create_network()
+        try:
+            asyncio.run(RouteService(airline_graph, airport_table).serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+    else:
+        main()
@@ -0,0 +1,617 @@
+import asyncio
+import json
+import random
+import numpy as np
+import pytest
+from main import (METRICS, MINUTES_PER_DAY, FlightSchedule, Graph, HashTable, RouteClient, RoutePool, RouteService,
+                  ROUTE_DTYPE, RouteCache, RouteRanking, SharedGraph, format_time)
+
+def check_hashtable_against_dict(compact, rehash_step, seed):
+    rnd = random.Random(seed)
+    table = HashTable(rnd.choice([1, 2, 16]), rehash_step=rehash_step, compact=compact)
+    expected = {}
+    keys = [a + b + c for a in 'ABC' for b in ['', 'A', 'B', 'C'] for c in ['', 'B']]
+    for _ in range(2000):
+        key = rnd.choice(keys)
+        operation = rnd.random()
+        if operation < 0.45:
+            table.insert(key, key.lower())
+            expected[key] = key.lower()
+        elif operation < 0.8:
+            table.delete(key)
+            expected.pop(key, None)
+        else:
+            assert table.search(key) == expected.get(key)
+        assert table.item_count == len(expected)
+    assert sorted(table.items()) == sorted(expected.items())
+    # A key lives in exactly one of table / old_table.
+    assert len(list(table.items())) == len(expected)
+    assert list(table.search_many(keys)) == [expected.get(key) for key in keys]
+
+def test_hashtable_matches_dict():
+    for compact in (False, True):
+        for rehash_step in (1, 2, 16):
+            for seed in range(10):
+                check_hashtable_against_dict(compact, rehash_step, seed)
+
+def test_hashtable_shrink_then_insert():
+    # Shrinking used to leave no free slot for keys still migrating from old_table.
+    for compact in (False, True):
+        table = HashTable(16, rehash_step=2, compact=compact)
+        table.insert('BB', 'v')
+        table.insert('ACB', 'v')
+        table.delete('BB')
+        table.insert('BCB', 'v')
+        assert table.search('CA') is None
+        table.insert('A', 'v')
+        assert sorted(table.items()) == [('A', 'v'), ('ACB', 'v'), ('BCB', 'v')]
+
+def random_graph(rnd, num_airports, num_routes, min_weight=0, max_weight=50):
+    graph = Graph(2)
+    codes = [f"A{i}" for i in range(num_airports)]
+    for code in codes:
+        graph.add_vertex(code)
+    for _ in range(num_routes):
+        graph.add_edge(rnd.choice(codes), rnd.choice(codes), rnd.randint(min_weight, max_weight))
+    return graph, codes
+
+def test_shortest_path_matches_enumeration():
+    rnd = random.Random(0)
+    for _ in range(100):
+        graph, codes = random_graph(rnd, rnd.randint(2, 7), rnd.randint(0, 20), min_weight=1)
+        # Coordinates on only some airports, so the A* estimate falls back to 0 elsewhere.
+        # They lie within a kilometre, so every weight is at least the great-circle distance.
+        for code in codes:
+            if rnd.random() < 0.5:
+                graph.set_coordinates(code, rnd.uniform(-0.004, 0.004), rnd.uniform(-0.004, 0.004))
+        for _ in range(5):
+            start, destination = rnd.choice(codes), rnd.choice(codes)
+            for max_layovers in (0, 1, 2, None):
+                limit = len(codes) if max_layovers is None else max_layovers
+                routes = graph.bfs(start, destination, limit)
+                expected = int(routes['distance'].min()) if routes.size else None
+                for heuristic in (False, True):
+                    found = graph.shortest_path(start, destination, max_layovers, heuristic)
+                    if expected is None:
+                        assert found.size == 0
+                        continue
+                    path = [graph._get_vertex_index(code) for code in found[0]['path']]
+                    indptr, indices, weights = graph._csr()
+                    cost = sum(min(weights[edge] for edge in range(indptr[a], indptr[a + 1]) if indices[edge] == b)
+                               for a, b in zip(path, path[1:]))
+                    assert int(found[0]['distance']) == expected == cost
+
+def test_astar_reopens_airport_without_coordinates():
+    graph = Graph(4)
+    for code in 'SXMT':
+        graph.add_vertex(code)
+    graph.set_coordinates('S', 0, 0)
+    graph.set_coordinates('X', 0, 0.05)
+    graph.set_coordinates('T', 0, 2)
+    for start, end, weight in (('S', 'M', 100), ('S', 'X', 10), ('X', 'M', 10), ('M', 'T', 1000)):
+        graph.add_edge(start, end, weight)
+    route = graph.shortest_path('S', 'T', heuristic=True)[0]
+    assert route['path'].tolist() == ['S', 'X', 'M', 'T'] and route['distance'] == 1020
+
+def test_negative_weights_rejected():
+    graph = Graph(2)
+    graph.add_vertex('S')
+    graph.add_vertex('M')
+    with pytest.raises(ValueError):
+        graph.add_edge('S', 'M', -8)
+    assert graph.apply_deltas([('add_route', 'S', 'M', -8)]) == 0
+
+def test_load_csv_skips_only_bad_rows(tmp_path):
+    graph = Graph(4)
+    for code in ('MEL', 'LAX', 'SYD', 'BKK'):
+        graph.add_vertex(code)
+    rows = ['MEL,LAX,100', 'MEL,SYD', 'LAX,SYD,x', 'MEL,LAX,99999999999999999999',
+            'SYD,JFK,10', 'SYD,BKK,-5', 'BKK,MEL,70', 'SYD,MEL,30']
+    filename = tmp_path / 'routes.csv'
+    filename.write_text('\n'.join(rows) + '\n')
+    assert graph.load_csv(str(filename)) == 3
+    assert [line for line, _ in graph.load_errors] == [2, 3, 4, 5, 6]
+    assert sorted((str(code), int(weight)) for code, weight in graph.neighbors(graph._get_vertex_index('MEL'))) == [('LAX', 100)]
+
+def test_load_csv_oversized_weight_keeps_chunk(tmp_path):
+    graph = Graph(2)
+    graph.add_vertex('MEL')
+    graph.add_vertex('LAX')
+    filename = tmp_path / 'routes.csv'
+    filename.write_text('MEL,LAX,1\n' * 3 + 'MEL,LAX,99999999999999999999\n' + 'LAX,MEL,2\n' * 3)
+    assert graph.load_csv(str(filename)) == 6
+    assert graph.load_errors == [(4, "invalid weight '99999999999999999999'")]
+
+def serve_and_run(service, scenario):
+    async def run():
+        server = await service.start('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            return await scenario(port)
+        finally:
+            server.close()
+            await server.wait_closed()
+    return asyncio.run(run())
+
+def test_service_answers_oversized_and_large_requests():
+    graph = Graph(2)
+    for code in ('MEL', 'LAX'):
+        graph.add_vertex(code)
+    service = RouteService(graph, HashTable(8), max_line=1024)
+
+    async def scenario(port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'{"id": 1, "op": "lookup_airport", "code": "' + b'X' * 5000 + b'"}\n')
+        writer.write(b'{"id": 2, "op": "lookup_airport", "code": "MEL"}\n')
+        await writer.drain()
+        replies = [json.loads(await reader.readline()) for _ in range(2)]
+        writer.close()
+        return replies
+
+    replies = serve_and_run(service, scenario)
+    assert replies[0]['ok'] is False and replies[0]['id'] is None
+    assert replies[1] == {'id': 2, 'ok': True, 'result': None}
+
+    events = [['add_route', 'MEL', 'LAX', distance] for distance in range(1, 4001)]
+
+    async def large(port):
+        client = await RouteClient.connect('127.0.0.1', port)
+        try:
+            return await client.request('apply_deltas', events=events)
+        finally:
+            await client.close()
+
+    reply = serve_and_run(RouteService(graph, HashTable(8)), large)
+    assert reply['ok'] and reply['result']['applied'] == 4000
+
+def test_client_fails_waiters_on_bad_reply():
+    async def run():
+        async def garbage(reader, writer):
+            await reader.readline()
+            writer.write(b'not json\n')
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(garbage, '127.0.0.1', 0)
+        client = await RouteClient.connect('127.0.0.1', server.sockets[0].getsockname()[1])
+        try:
+            with pytest.raises(ConnectionError):
+                await asyncio.wait_for(client.request('lookup_airport', code='MEL'), 5)
+        finally:
+            await client.close()
+            server.close()
+            await server.wait_closed()
+
+    asyncio.run(run())
+
+def test_metrics_cover_both_menu_queries():
+    graph = Graph(4)
+    for code in ('MEL', 'SYD', 'BKK', 'LHR'):
+        graph.add_vertex(code)
+    for start, end, weight in (('MEL', 'SYD', 1), ('SYD', 'BKK', 2), ('MEL', 'BKK', 5), ('BKK', 'LHR', 9), ('SYD', 'LHR', 20)):
+        graph.add_edge(start, end, weight)
+    METRICS.reset()
+    METRICS.enabled = True
+    try:
+        graph.find_routes('MEL', 'LHR', 2, 'layovers')
+        assert METRICS.counters['graph_bfs_nodes_expanded_total'] > 0
+        assert METRICS.gauges['graph_bfs_frontier_peak'] > 0
+        graph.find_routes('MEL', 'LHR', 2, 'distance', 10)
+        assert METRICS.counters['graph_k_shortest_routes_emitted_total'] == 3
+        assert METRICS.counters['graph_k_shortest_nodes_expanded_total'] > 0
+        assert METRICS.summaries['graph_k_shortest_seconds'][1] == 1
+    finally:
+        METRICS.enabled = False
+        METRICS.reset()
+
+def test_close_and_reopen_airports_match_rebuilt_graph():
+    rnd = random.Random(3)
+    codes = ['MEL', 'SYD', 'BKK', 'LHR', 'JFK']
+    graph = Graph(len(codes))
+    for code in codes:
+        graph.add_vertex(code)
+    open_codes, routes = set(codes), []
+    for _ in range(3000):
+        start, end = rnd.choice(codes), rnd.choice(codes)
+        operation = rnd.random()
+        if operation < 0.6:
+            weight = rnd.randint(1, 50)
+            graph.add_edge(start, end, weight)
+            if start in open_codes and end in open_codes:
+                routes.append((start, end, weight))
+        elif operation < 0.7:
+            graph.remove_edge(start, end)
+            routes = [route for route in routes if route[:2] != (start, end)]
+        elif operation < 0.85 and start in open_codes:
+            assert graph.remove_vertex(start)
+            open_codes.discard(start)
+            routes = [route for route in routes if start not in route[:2]]
+        elif start not in open_codes:
+            graph.add_vertex(start)
+            open_codes.add(start)
+    # Reopened airports take back their slots instead of growing the graph.
+    assert graph.vertex_count == len(codes)
+    rebuilt = Graph(len(codes))
+    for code in codes:
+        rebuilt.add_vertex(code)
+    for route in routes:
+        rebuilt.add_edge(*route)
+    for start in open_codes:
+        for end in open_codes:
+            found = sorted(route['distance'] for route in graph.bfs(start, end, 0))
+            assert found == sorted(route['distance'] for route in rebuilt.bfs(start, end, 0))
+
+def test_duplicate_code_takes_over_after_close():
+    graph = Graph(4)
+    for code in ('MEL', 'SYD', 'MEL', 'MEL'):
+        graph.add_vertex(code)
+    assert graph._get_vertex_index('MEL') == 0
+    graph.remove_vertex('MEL')
+    assert graph._get_vertex_index('MEL') == 2
+    graph.add_vertex('MEL')
+    graph.remove_vertex('MEL')
+    assert graph._get_vertex_index('MEL') == 0
+    assert graph.vertex_count == 4
+
+def enumerate_routes(routes, start, destination, max_layovers):
+    # The baseline Graph.bfs from test.py on plain lists: a FIFO queue of simple paths,
+    # expanded while they have at most max_layovers + 1 airports.
+    found = []
+    queue = [([start], 0)]
+    while queue:
+        path, distance = queue.pop(0)
+        if path[-1] == destination:
+            found.append((path, distance))
+        if len(path) <= max_layovers + 1:
+            for origin, end, weight in routes:
+                if origin == path[-1] and end not in path:
+                    queue.append((path + [end], distance + weight))
+    return found
+
+def route_list(routes):
+    return [(route['path'].tolist(), int(route['distance'])) for route in routes]
+
+def random_routes(rnd, codes, count):
+    return [(rnd.choice(codes), rnd.choice(codes), rnd.randint(1, 30)) for _ in range(count)]
+
+def build_graph(codes, routes):
+    graph = Graph(2)
+    for code in codes:
+        graph.add_vertex(code)
+    for route in routes:
+        graph.add_edge(*route)
+    return graph
+
+def test_route_searches_match_baseline_enumeration():
+    rnd = random.Random(5)
+    for _ in range(60):
+        codes = [f"A{i}" for i in range(rnd.randint(1, 6))]
+        routes = random_routes(rnd, codes, rnd.randint(0, 14))
+        graph = build_graph(codes, routes)
+        queries = [(rnd.choice(codes), rnd.choice(codes), rnd.randint(0, 4)) for _ in range(6)]
+        batch = graph.batch_routes(queries)
+        for query, (start, destination, max_layovers) in enumerate(queries):
+            expected = enumerate_routes(routes, start, destination, max_layovers)
+            assert route_list(graph.bfs(start, destination, max_layovers)) == expected
+            assert route_list(batch[batch['query'] == query]) == expected
+            # Bidirectional search returns the same routes, ordered by layovers only.
+            both = graph.bfs(start, destination, max_layovers, bidirectional=True)
+            assert sorted(route_list(both)) == sorted(expected)
+            assert list(both['layovers']) == sorted(both['layovers'])
+
+def test_route_pool_matches_baseline_enumeration():
+    rnd = random.Random(6)
+    codes = [f"A{i}" for i in range(6)]
+    routes = random_routes(rnd, codes, 18)
+    graph = build_graph(codes, routes)
+    queries = [(rnd.choice(codes), rnd.choice(codes), rnd.randint(0, 4)) for _ in range(12)]
+    with RoutePool(graph, workers=2) as pool:
+        batch = pool.batch_routes(queries)
+        for query, (start, destination, max_layovers) in enumerate(queries):
+            expected = enumerate_routes(routes, start, destination, max_layovers)
+            assert route_list(pool.bfs(start, destination, max_layovers)) == expected
+            assert route_list(batch[batch['query'] == query]) == expected
+
+def test_k_shortest_routes_match_sorted_bfs():
+    rnd = random.Random(7)
+    for _ in range(60):
+        codes = [f"A{i}" for i in range(rnd.randint(1, 6))]
+        graph = build_graph(codes, random_routes(rnd, codes, rnd.randint(0, 14)))
+        start, destination = rnd.choice(codes), rnd.choice(codes)
+        for max_layovers in (0, 1, 3, None):
+            limit = len(codes) if max_layovers is None else max_layovers
+            expected = sorted(int(distance) for distance in graph.bfs(start, destination, limit)['distance'])
+            found = [int(distance) for _, _, distance in graph.k_shortest_routes(start, destination, max_layovers=max_layovers)]
+            assert found == expected
+            assert [int(distance) for _, _, distance in graph.k_shortest_routes(start, destination, 2, max_layovers)] == expected[:2]
+
+def brute_force_arrival(flights, start, destination, ready, max_legs, visited, min_connection):
+    # Tries every simple itinerary, taking each flight on the first day it can be caught.
+    if start == destination:
+        return ready
+    if max_legs == 0:
+        return None
+    best = None
+    for origin, end, departure, arrival in flights:
+        if origin != start or end in visited:
+            continue
+        day = -((departure - ready) // MINUTES_PER_DAY)
+        landed = brute_force_arrival(flights, end, destination, arrival + day * MINUTES_PER_DAY + min_connection,
+                                     max_legs - 1, visited | {end}, min_connection)
+        if landed is not None and (best is None or landed < best):
+            best = landed
+    return best
+
+def test_earliest_arrival_matches_brute_force(tmp_path):
+    rnd = random.Random(8)
+    for trial in range(40):
+        codes = [f"A{i}" for i in range(rnd.randint(2, 5))]
+        graph = build_graph(codes, [])
+        flights = []
+        for _ in range(rnd.randint(0, 12)):
+            departure = rnd.randrange(MINUTES_PER_DAY)
+            flights.append((rnd.choice(codes), rnd.choice(codes), departure, departure + rnd.randint(30, 900)))
+        filename = tmp_path / f'flights{trial}.csv'
+        filename.write_text(''.join(f"{origin},{end},{format_time(departure)},{format_time(arrival % MINUTES_PER_DAY)}\n"
+                                    for origin, end, departure, arrival in flights))
+        schedule = FlightSchedule(graph)
+        schedule.load_csv(str(filename))
+        for _ in range(5):
+            start, destination = rnd.sample(codes, 2)
+            depart_after = rnd.randrange(MINUTES_PER_DAY)
+            for max_layovers in (0, 1, 2, None):
+                max_legs = len(codes) if max_layovers is None else max_layovers + 1
+                # The brute force adds the connection time after the last leg as well.
+                expected = brute_force_arrival(flights, start, destination, depart_after, max_legs, {start}, schedule.min_connection)
+                legs = schedule.earliest_arrival(start, destination, depart_after, max_layovers)
+                if expected is None:
+                    assert legs.size == 0
+                    continue
+                assert int(legs[-1]['arrival']) + schedule.min_connection == expected
+                assert legs[0]['origin'] == start and legs[-1]['destination'] == destination
+                assert legs.size <= max_legs and legs[0]['departure'] >= depart_after
+                for previous, leg in zip(legs, legs[1:]):
+                    assert leg['origin'] == previous['destination']
+                    assert leg['departure'] >= previous['arrival'] + schedule.min_connection
+
+def graph_state(graph):
+    graph.merge_pending()
+    return ([str(code) for code in graph.vertices[:graph.vertex_count]], sorted(graph.removed),
+            graph.indptr.tolist(), graph.indices.tolist(), graph.weights.tolist())
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_graph_snapshot_round_trip(tmp_path, mmap):
+    graph = build_graph(['MEL', 'LAX', 'SYD', 'BKK'], [('MEL', 'LAX', 100), ('LAX', 'SYD', 50), ('SYD', 'MEL', 20)])
+    graph.set_coordinates('MEL', -37.7, 144.8)
+    graph.remove_vertex('BKK')
+    filename = str(tmp_path / 'graph.snap')
+    graph.save(filename)
+    loaded = Graph.load(filename, mmap=mmap)
+    assert graph_state(loaded) == graph_state(graph)
+    assert loaded.coordinates[0].tolist() == [-37.7, 144.8]
+    # Saving a loaded graph over its own file used to truncate the arrays it was mapped from.
+    loaded.add_edge('MEL', 'SYD', 7)
+    loaded.save(filename)
+    expected = graph_state(loaded)
+    for mode in (True, False):
+        reloaded = Graph.load(filename, mmap=mode)
+        assert graph_state(reloaded) == expected
+        assert route_list(reloaded.bfs('MEL', 'SYD', 1)) == [(['MEL', 'SYD'], 7), (['MEL', 'LAX', 'SYD'], 150)]
+    assert [path.name for path in tmp_path.iterdir()] == ['graph.snap']
+
+@pytest.mark.parametrize('mmap', [True, False])
+@pytest.mark.parametrize('compact', [False, True])
+def test_hashtable_snapshot_round_trip(tmp_path, mmap, compact):
+    table = HashTable(8, compact=compact)
+    expected = {}
+    for number in range(40):
+        table.insert(f"K{number}", f"value {number}")
+        expected[f"K{number}"] = f"value {number}"
+    for number in range(0, 40, 3):
+        table.delete(f"K{number}")
+        del expected[f"K{number}"]
+    filename = str(tmp_path / 'table.snap')
+    table.save(filename)
+    loaded = HashTable.load(filename, mmap=mmap)
+    assert sorted(loaded.items()) == sorted(expected.items())
+    loaded.insert('NEW', 'fresh')
+    expected['NEW'] = 'fresh'
+    loaded.save(filename)
+    for mode in (True, False):
+        reloaded = HashTable.load(filename, mmap=mode)
+        assert sorted(reloaded.items()) == sorted(expected.items())
+        assert reloaded.search('K1') == 'value 1' and reloaded.search('K0') is None
+
+def test_apply_deltas_records_bad_distances():
+    graph = build_graph(['MEL', 'LAX'], [])
+    events = json.loads('[["add_route", "MEL", "LAX", 5], ["add_route", "MEL", "LAX", Infinity], '
+                        '["add_route", "MEL", "LAX", NaN], ["add_route", "LAX", "MEL", 1.9], '
+                        '["reweight_route", "MEL", "LAX", -Infinity], ["add_route", "LAX", "MEL", 12.0]]')
+    assert graph.apply_deltas(events) == 2
+    assert [position for position, _ in graph.delta_errors] == [1, 2, 3, 4]
+    assert route_list(graph.bfs('LAX', 'MEL', 0)) == [(['LAX', 'MEL'], 12)]
+
+def test_reopened_airport_reuses_slot_after_reload(tmp_path):
+    graph = build_graph(['MEL', 'LAX', 'SYD'], [('MEL', 'LAX', 1), ('LAX', 'SYD', 2)])
+    graph.remove_vertex('LAX')
+    filename = str(tmp_path / 'graph.snap')
+    graph.save(filename)
+    for mmap in (True, False):
+        loaded = Graph.load(filename, mmap=mmap)
+        loaded.add_vertex('LAX')
+        assert loaded._get_vertex_index('LAX') == 1 and loaded.vertex_count == 3
+        assert loaded.bfs('MEL', 'SYD', 1).size == 0
+
+def test_compact_arena_stays_bounded_under_churn():
+    table = HashTable(16, compact=True)
+    for number in range(10000):
+        table.insert('MEL', ('x' * 100) if number % 2 else ('y' * (number % 150)))
+    assert table.search('MEL') == 'x' * 100
+    slots = table.table
+    assert slots.arena_used <= 2 * slots.arena_live + 64 + 150
+    expected = {'MEL': 'x' * 100}
+    rnd = random.Random(9)
+    for _ in range(5000):
+        key = rnd.choice(['A', 'B', 'C', 'AB', 'BC'])
+        if rnd.random() < 0.3:
+            table.delete(key)
+            expected.pop(key, None)
+        else:
+            value = 'v' * rnd.randint(0, 80)
+            table.insert(key, value)
+            expected[key] = value
+    slots = table.table
+    assert sorted(table.items()) == sorted(expected.items())
+    assert slots.arena_live == sum(len(value) for value in expected.values())
+    assert slots.arena.size <= 4 * (slots.arena_live + 64 + 80)
+
+def test_shared_graph_reads_blocks_without_copies():
+    rnd = random.Random(10)
+    codes = [f"A{i}" for i in range(6)]
+    routes = random_routes(rnd, codes, 20)
+    graph = build_graph(codes, routes)
+    with SharedGraph(graph) as shared:
+        attached, blocks = SharedGraph.attach(shared.spec)
+        try:
+            assert all(isinstance(column, memoryview) for column in attached._csr())
+            for start in codes:
+                assert route_list(attached.bfs(start, 'A0', 3)) == enumerate_routes(routes, start, 'A0', 3)
+        finally:
+            attached._adjacency = None
+            del attached
+            for block in blocks:
+                block.close()
+
+def test_precomputed_pruning_keeps_route_results():
+    rnd = random.Random(11)
+    for _ in range(40):
+        codes = [f"A{i}" for i in range(rnd.randint(1, 7))]
+        routes = random_routes(rnd, codes, rnd.randint(0, 16))
+        graph = build_graph(codes, routes)
+        if rnd.random() < 0.3:
+            graph.remove_vertex(rnd.choice(codes))
+        queries = [(rnd.choice(codes), rnd.choice(codes), rnd.randint(0, 3)) for _ in range(8)]
+        unpruned = [route_list(graph.bfs(*query)) for query in queries]
+        unpruned_batch = route_list(graph.batch_routes(queries))
+        graph.precompute(3)
+        assert graph._precomputed_legs() == 4
+        assert [route_list(graph.bfs(*query)) for query in queries] == unpruned
+        assert route_list(graph.batch_routes(queries)) == unpruned_batch
+        for query, found in zip(queries, unpruned):
+            assert graph.min_distance(*query) == (min(distance for _, distance in found) if found else None)
+
+def test_load_precomputed_rejects_other_network(tmp_path):
+    routes = [('MEL', 'SYD', 5), ('SYD', 'BKK', 7)]
+    graph = build_graph(['MEL', 'SYD', 'BKK'], routes)
+    graph.precompute(2)
+    filename = str(tmp_path / 'legs.npz')
+    graph.save_precomputed(filename)
+    other = build_graph(['MEL', 'SYD', 'BKK'], routes + [('MEL', 'BKK', 3)])
+    assert other.load_precomputed(filename) is False
+    assert other._precomputed_legs() == -1 and other.min_distance('MEL', 'BKK', 1) == 3
+    same = build_graph(['MEL', 'SYD', 'BKK'], routes)
+    assert same.load_precomputed(filename) is True
+    assert same._precomputed_legs() == 3 and same.min_distance('MEL', 'BKK', 1) == 12
+
+def test_route_cache_counts_hits_misses_and_evictions():
+    graph = build_graph(['MEL', 'SYD', 'BKK'], [('MEL', 'SYD', 5), ('SYD', 'BKK', 7), ('MEL', 'BKK', 20)])
+    graph.route_cache = RouteCache(max_entries=2)
+    first = graph.find_routes('MEL', 'BKK', 1)
+    assert graph.find_routes('MEL', 'BKK', 1) is first
+    graph.find_routes('SYD', 'BKK', 1)
+    graph.find_routes('MEL', 'SYD', 1)
+    assert graph.route_cache.stats() == {'entries': 2, 'bytes': graph.route_cache.bytes, 'hits': 1, 'misses': 3,
+                                         'evictions': 1, 'invalidations': 0}
+    # The least recently used entry was evicted, so it is computed again.
+    assert graph.find_routes('MEL', 'BKK', 1) is not first
+    assert graph.route_cache.misses == 4 and graph.route_cache.evictions == 2
+    assert route_list(first) == [(['MEL', 'SYD', 'BKK'], 12), (['MEL', 'BKK'], 20)]
+
+def test_route_cache_byte_bound():
+    graph = build_graph(['MEL', 'SYD', 'BKK'], [('MEL', 'SYD', 5), ('SYD', 'BKK', 7), ('MEL', 'BKK', 20)])
+    routes = graph.find_routes('MEL', 'BKK', 1)
+    size = graph.route_cache._size(routes)
+    cache = RouteCache(max_bytes=2 * size)
+    # Results are only stored for the version the last lookup saw.
+    assert cache.get(0, 0) is None
+    for key in range(5):
+        cache.put(key, 0, routes)
+        assert cache.bytes <= 2 * size
+    assert list(cache.entries) == [3, 4] and cache.evictions == 3
+    # A result larger than the whole budget is not stored at all.
+    small = RouteCache(max_bytes=size - 1)
+    small.get('big', 0)
+    small.put('big', 0, routes)
+    assert not small.entries and small.bytes == 0
+
+def test_route_cache_invalidated_by_every_mutation(tmp_path):
+    filename = tmp_path / 'routes.csv'
+    filename.write_text('SYD,MEL,4\n')
+    mutations = [
+        lambda graph: graph.add_vertex('LHR'),
+        lambda graph: graph.add_edge('MEL', 'BKK', 3),
+        lambda graph: graph.load_csv(str(filename)),
+        lambda graph: graph.remove_vertex('SYD'),
+        lambda graph: graph.remove_edge('MEL', 'SYD'),
+        lambda graph: graph.reweight_edge('MEL', 'BKK', 30),
+    ]
+    for mutate in mutations:
+        graph = build_graph(['MEL', 'SYD', 'BKK'], [('MEL', 'SYD', 5), ('SYD', 'BKK', 7), ('MEL', 'BKK', 20)])
+        before = graph.find_routes('MEL', 'BKK', 1)
+        assert graph.find_routes('MEL', 'BKK', 1) is before
+        mutate(graph)
+        after = graph.find_routes('MEL', 'BKK', 1)
+        assert after is not before and graph.route_cache.invalidations == 1
+        assert sorted(route_list(after), key=lambda route: route[1]) == sorted(route_list(graph.bfs('MEL', 'BKK', 1)), key=lambda route: route[1])
+
+def test_route_ranking_matches_sorted():
+    rnd = random.Random(12)
+    for size in (0, 1, 5, 40):
+        routes = np.empty((size,), dtype=ROUTE_DTYPE)
+        # The path column carries each row's input position; few distinct values force ties.
+        routes['path'] = np.arange(size)
+        routes['layovers'] = [rnd.randint(0, 2) for _ in range(size)]
+        routes['distance'] = [rnd.randint(0, 4) for _ in range(size)]
+        for sort_by, fields in ((('distance', 'layovers'), ('distance', 'layovers')), ('layovers', ('layovers',)),
+                                ((2, 1), ('distance', 'layovers'))):
+            expected = sorted(range(size), key=lambda row: tuple(int(routes[field][row]) for field in fields) + (row,))
+            assert routes[RouteRanking.order(routes, sort_by)]['path'].tolist() == expected
+            assert RouteRanking.sort(routes, sort_by)['path'].tolist() == expected
+            for k in (0, 1, 2, 3, size // 2, size - 1, size, size + 5):
+                assert RouteRanking.top_k(routes, k, sort_by)['path'].tolist() == expected[:max(k, 0)]
+
+def test_icao_codes_survive_every_layer(tmp_path):
+    graph = build_graph(['MEL', 'SYD'], [])
+    graph.add_vertex('EGLL')
+    for start, end, weight in (('MEL', 'SYD', 5), ('SYD', 'EGLL', 170), ('MEL', 'EGLL', 200)):
+        graph.add_edge(start, end, weight)
+    expected = [(['MEL', 'EGLL'], 200), (['MEL', 'SYD', 'EGLL'], 175)]
+    assert route_list(graph.bfs('MEL', 'EGLL', 1)) == expected
+    batch = graph.batch_routes([('MEL', 'EGLL', 1), ('EGLL', 'EGLL', 0)])
+    assert route_list(batch) == expected + [(['EGLL'], 0)]
+    assert batch['destination'].tolist() == ['EGLL'] * 3 and batch['origin'].tolist()[-1] == 'EGLL'
+
+    filename = tmp_path / 'flights.csv'
+    filename.write_text('MEL,SYD,08:00,09:30,QF1\nSYD,EGLL,11:00,05:00,QF1\n')
+    schedule = FlightSchedule(graph)
+    assert schedule.load_csv(str(filename)) == 2
+    legs = schedule.earliest_arrival('MEL', 'EGLL', '07:00')
+    assert legs['origin'].tolist() == ['MEL', 'SYD'] and legs['destination'].tolist() == ['SYD', 'EGLL']
+
+    snapshot = str(tmp_path / 'graph.snap')
+    graph.save(snapshot)
+    for mmap in (True, False):
+        loaded = Graph.load(snapshot, mmap=mmap)
+        assert loaded._get_vertex_index('EGLL') == 2
+        assert route_list(loaded.bfs('MEL', 'EGLL', 1)) == expected
+
+    with SharedGraph(graph) as shared:
+        attached, blocks = SharedGraph.attach(shared.spec)
+        try:
+            assert route_list(attached.bfs('MEL', 'EGLL', 1)) == expected
+            assert route_list(attached.batch_routes([('MEL', 'EGLL', 1)])) == expected
+        finally:
+            attached._adjacency = None
+            del attached
+            for block in blocks:
+                block.close()